@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Cross-checks conversion engines of redcap2xlsform on data dictionaries.
+
+Every file is converted by each engine in both modes and converted forms
+must be the same, differences are printed and the script exits with
+status 1.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redcap2xlsform
+from generate_redcap import generateDictionary
+
+
+def convertWithEngine(filename, engine, mode):
+    """Returns converted forms of the file and time of conversion."""
+    content = redcap2xlsform.readRedcapFile(filename)
+    start = time.perf_counter()
+    converted = redcap2xlsform.converterFromEngine[engine](content, mode, []).convert()
+    return converted, time.perf_counter() - start
+
+
+def describeForms(forms):
+    """Returns converted forms as plain values to compare."""
+    return [(form.name, form.headers, form.questions,
+             [(choice.listName, choice.name, choice.label) for choice in form.choices])
+            for form in forms]
+
+
+def findDifferences(expected, actual):
+    """Returns descriptions of first differences between converted forms."""
+    if len(expected) != len(actual):
+        return ['{} forms instead of {}'.format(len(actual), len(expected))]
+
+    differences = []
+    for expectedForm, actualForm in zip(expected, actual):
+        for part, expectedValue, actualValue in zip(('name', 'headers', 'questions', 'choices'),
+                                                    expectedForm, actualForm):
+            if expectedValue != actualValue:
+                differences.append('form {}: {} differ'.format(expectedForm[0], part))
+    return differences
+
+
+def parseArgs():
+    """Returns parsed arguments of the check."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("filenames", nargs='*',
+                           help="REDCap files to check (default: generated dictionaries)")
+    argParser.add_argument("--sizes", type=int, nargs='*', default=[1000, 10000],
+                           help="Numbers of rows of generated dictionaries")
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tempDir:
+        filenames = args.filenames
+        if not filenames:
+            for size in args.sizes:
+                filenames.append(os.path.join(tempDir, 'dictionary_{}.csv'.format(size)))
+                generateDictionary(filenames[-1], size)
+
+        for filename in filenames:
+            for mode in ('zip_xls', 'single_xls'):
+                expected, expectedSeconds = convertWithEngine(filename, 'rows', mode)
+                for engine in sorted(redcap2xlsform.converterFromEngine):
+                    if engine == 'rows':
+                        continue
+                    actual, seconds = convertWithEngine(filename, engine, mode)
+                    differences = findDifferences(describeForms(expected), describeForms(actual))
+                    print('{} {} {}: {:.3f}s (rows: {:.3f}s) {}'.format(
+                        os.path.basename(filename), mode, engine, seconds, expectedSeconds,
+                        'differs' if differences else 'same'))
+                    for difference in differences:
+                        print('  ' + difference)
+                    failed = failed or bool(differences)
+
+    exit(1 if failed else 0)
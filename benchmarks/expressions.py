@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Checks that branching logic and calculations convert in linear time.
+
+Pathological expressions are repeated up to very long lengths and cost of
+conversion per character is reported, which should stay flat. Random
+expressions are fuzzed through both converters, calculations are compared
+with the previous two pass translation. Exits with status 1 if cost per
+character grows more than --growth times or fuzzing finds a difference.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redcap2xlsform
+
+
+patterns = ['[', '[a', '[a(', '[a(b', '[a(b)]', '[a(b)] = "', '[a] ', '[a]=', '[a] <> ',
+            '<>', '= ', ' ', 'a', '[a] = "1" and ', '([a(1)] = "0" or [b] <> \'x\') ']
+fuzzAlphabet = '[]()ab1_ =<>!\'"'
+
+
+def translateRelevant(expression):
+    return redcap2xlsform.RelevantConverter.translate.__wrapped__(expression)
+
+
+def translateCalculation(expression):
+    return redcap2xlsform.CalculationsConverter.translate(expression)
+
+
+def translateCalculationTwoPasses(expression):
+    """Returns calculation translated like before the single pass translation."""
+    converted = re.sub(r"\[(\w+)\]", r"${\1}", expression)
+    return re.sub(r"\[(\w+)\((\w+)\)\]", r"selected(${\1},'\2')", converted)
+
+
+def costPerCharacter(translate, expression, repeat):
+    """Returns best time of translation per character in nanoseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        translate(expression)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(expression) * 1e9
+
+
+def measureScaling(lengths, repeat):
+    """Returns costs per character of patterns repeated to given lengths."""
+    results = {}
+    for pattern in patterns:
+        for name, translate in (('relevant', translateRelevant),
+                                ('calculation', translateCalculation)):
+            costs = []
+            for length in lengths:
+                expression = pattern * (length // len(pattern))
+                costs.append(costPerCharacter(translate, expression, repeat))
+            results[(pattern, name)] = costs
+    return results
+
+
+def fuzz(count, maxLength, seed):
+    """Returns descriptions of fuzzed expressions failing the checks."""
+    generator = random.Random(seed)
+    failures = []
+    for _ in range(count):
+        length = generator.randint(1, maxLength)
+        expression = ''.join(generator.choice(fuzzAlphabet) for _ in range(length))
+        try:
+            translateRelevant(expression)
+            converted = translateCalculation(expression)
+        except Exception as e:
+            failures.append('{!r}: {}'.format(expression, e))
+            continue
+        if converted != translateCalculationTwoPasses(expression):
+            failures.append('{!r}: calculation differs from two pass translation'.format(expression))
+    return failures
+
+
+def parseArgs():
+    """Returns parsed arguments of the check."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--lengths", type=int, nargs='*', default=[1000, 10000, 100000],
+                           help="Lengths of pathological expressions in characters")
+    argParser.add_argument("--repeat", type=int, default=3,
+                           help="Number of timed runs, the best one is reported")
+    argParser.add_argument("--growth", type=float, default=3.0,
+                           help="Allowed growth of cost per character from the shortest " +
+                                "to the longest expression (default: 3)")
+    argParser.add_argument("--fuzz", type=int, default=20000,
+                           help="Number of random expressions to fuzz")
+    argParser.add_argument("--fuzzlength", type=int, default=40,
+                           help="Maximal length of random expressions")
+    argParser.add_argument("--seed", type=int, default=0)
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    failed = False
+    print('{:<32} {:<12} '.format('pattern', 'converter') +
+          ' '.join('{:>12}'.format('{} ch'.format(length)) for length in args.lengths) +
+          '  (ns/char)')
+    for (pattern, name), costs in measureScaling(args.lengths, args.repeat).items():
+        growth = costs[-1] / costs[0]
+        flat = growth <= args.growth
+        failed = failed or not flat
+        print('{:<32} {:<12} '.format(repr(pattern), name) +
+              ' '.join('{:>12.1f}'.format(cost) for cost in costs) +
+              ('' if flat else '  grows {:.1f}x'.format(growth)))
+
+    failures = fuzz(args.fuzz, args.fuzzlength, args.seed)
+    for failure in failures[:20]:
+        print('Fuzz: ' + failure)
+    print('Fuzzed {} expressions, {} failed'.format(args.fuzz, len(failures)))
+
+    exit(1 if failed or failures else 0)
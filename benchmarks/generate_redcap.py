@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Generates synthetic REDCap data dictionaries for benchmarks."""
+import argparse
+import csv
+import random
+
+
+headers = ['Variable / Field Name', 'Form Name', 'Section Header', 'Field Type',
+           'Field Label', 'Choices, Calculations, OR Slider Labels', 'Field Note',
+           'Text Validation Type OR Show Slider Number', 'Text Validation Min',
+           'Text Validation Max', 'Identifier?',
+           'Branching Logic (Show field only if...)', 'Required Field?',
+           'Custom Alignment', 'Question Number (surveys only)',
+           'Matrix Group Name', 'Matrix Ranking?', 'Field Annotation']
+
+sharedChoices = ['1, Strongly agree | 2, Agree | 3, Neutral | 4, Disagree | 5, Strongly disagree',
+                 '1, Yes | 0, No | 9, Unknown',
+                 '0, Never | 1, Rarely | 2, Sometimes | 3, Often | 4, Always',
+                 '1, Mild | 2, Moderate | 3, Severe']
+
+plainLabels = ['How old are you?',
+               'Date of visit',
+               'Weight in kilograms',
+               'Did the participant complete the questionnaire?']
+
+htmlLabels = ['<b>Current</b> medication &amp; dosage',
+              '<p>Please answer <i>all</i> questions below</p>',
+              'Rate the <span style="color:red">pain</span> level<br>today']
+
+fieldTypes = ['radio', 'checkbox', 'dropdown', 'text', 'text', 'yesno', 'calc',
+              'notes', 'descriptive']
+
+
+def generateDictionary(filename, rows, rowsPerForm=200, seed=0):
+    """Writes synthetic REDCap data dictionary with given number of rows."""
+    generator = random.Random(seed)
+
+    with open(filename, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+
+        variables = []
+        for i in range(rows):
+            if i % rowsPerForm == 0:
+                variables = []
+            formName = 'form_{}'.format(i // rowsPerForm)
+            writer.writerow(_generateRow(generator, i, formName, variables))
+
+
+def _generateRow(generator, number, formName, variables):
+    name = 'field_{}'.format(number)
+    type_ = generator.choice(fieldTypes)
+    row = dict.fromkeys(headers, '')
+    row['Variable / Field Name'] = name
+    row['Form Name'] = formName
+    row['Field Type'] = type_
+
+    if generator.random() < 0.05:
+        row['Section Header'] = 'Section {}'.format(number)
+
+    if generator.random() < 0.3:
+        row['Field Label'] = generator.choice(htmlLabels)
+    else:
+        row['Field Label'] = generator.choice(plainLabels)
+
+    if type_ in ('radio', 'checkbox', 'dropdown'):
+        row['Choices, Calculations, OR Slider Labels'] = _generateChoices(generator, number)
+    elif type_ == 'calc':
+        row['Choices, Calculations, OR Slider Labels'] = _generateCalculation(generator, variables)
+    elif type_ == 'text':
+        _generateValidation(generator, row)
+
+    if variables and generator.random() < 0.4:
+        row['Branching Logic (Show field only if...)'] = _generateBranching(generator, variables)
+
+    if generator.random() < 0.3:
+        row['Required Field?'] = 'y'
+
+    annotation = generator.random()
+    if annotation < 0.1:
+        row['Field Annotation'] = '@DEFAULT="{}"'.format(generator.randint(0, 5))
+    elif annotation < 0.15:
+        row['Field Annotation'] = '@HIDDEN'
+
+    if generator.random() < 0.1:
+        row['Field Note'] = 'Note for {}'.format(name)
+
+    variables.append((name, type_))
+    return [row[header] for header in headers]
+
+
+def _generateChoices(generator, number):
+    if generator.random() < 0.8:
+        return generator.choice(sharedChoices)
+    count = generator.randint(2, 8)
+    return ' | '.join('{}, Option {} of field {}'.format(i, i, number) for i in range(1, count + 1))
+
+
+def _generateCalculation(generator, variables):
+    numeric = [name for name, type_ in variables if type_ in ('text', 'radio', 'dropdown')]
+    if not numeric:
+        return '1 + 1'
+    return ' + '.join('[{}]'.format(generator.choice(numeric)) for _ in range(generator.randint(1, 4)))
+
+
+def _generateValidation(generator, row):
+    validation = generator.choice(['', 'integer', 'number', 'date_dmy', 'time', 'email'])
+    row['Text Validation Type OR Show Slider Number'] = validation
+    if validation in ('integer', 'number') and generator.random() < 0.5:
+        row['Text Validation Min'] = '0'
+        row['Text Validation Max'] = str(generator.randint(10, 200))
+
+
+def _generateBranching(generator, variables):
+    conditions = []
+    for _ in range(generator.randint(1, 4)):
+        name, type_ = generator.choice(variables)
+        if type_ == 'checkbox':
+            conditions.append("[{}({})] = '{}'".format(name, generator.randint(1, 5),
+                                                       generator.choice('01')))
+        elif type_ == 'yesno':
+            conditions.append("[{}] = '1'".format(name))
+        else:
+            conditions.append("[{}] {} '{}'".format(name, generator.choice(['=', '<>', '>=']),
+                                                    generator.randint(0, 5)))
+    return generator.choice([' and ', ' or ', ' OR ']).join(conditions)
+
+
+def parseArgs():
+    """Returns number of rows and name of file to write dictionary to."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("rows", type=int)
+    argParser.add_argument("filename")
+    argParser.add_argument("--rowsperform", type=int, default=200,
+                           help="Number of rows in every form (default: 200)")
+    argParser.add_argument("--seed", type=int, default=0)
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    generateDictionary(args.filename, args.rows, args.rowsperform, args.seed)
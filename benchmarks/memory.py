@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Measures memory used by converting synthetic REDCap data dictionaries.
+
+Reports peak memory traced while forms are converted and memory retained
+by converted forms, per row of the dictionary, and memory used by single
+objects created for every row and choice.
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redcap2xlsform
+from generate_redcap import generateDictionary
+
+
+def measureMemory(filename, mode, engine):
+    """Returns peak and retained memory of converting the file in bytes."""
+    content = redcap2xlsform.readRedcapFile(filename)
+    converter = redcap2xlsform.converterFromEngine[engine](content, mode, [])
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    converted = converter.convert()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    choices = sum(len(form.choices) for form in converted)
+    return {'peak': peak - before, 'retained': retained - before, 'choices': choices}
+
+
+def objectSize(obj):
+    """Returns size of object with its attributes dict, not counting attribute values."""
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def measureObjects():
+    """Returns sizes of objects created for every row and choice in bytes."""
+    headers = [header for _, header in redcap2xlsform.ColumnPlan.redcapFields]
+    plan = redcap2xlsform.ColumnPlan(headers, ['name', 'type', 'label'], [])
+    row = redcap2xlsform.RowConverter(['name', 'radio', '', 'Label'] + [''] * 7, plan)
+    row.convertToXLS()
+    return {'XLSChoice': objectSize(redcap2xlsform.XLSChoice('list_0', '1', 'Yes')),
+            'RowConverter': objectSize(row),
+            'TypeConverter': objectSize(row.typeConverter)}
+
+
+def parseArgs():
+    """Returns parsed arguments of the benchmark."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--sizes", type=int, nargs='*', default=[10000, 100000],
+                           help="Numbers of rows of generated dictionaries")
+    argParser.add_argument("-m", "--mode", default='zip_xls',
+                           choices=['zip_xls', 'single_xls'],
+                           help="Mode of conversion (default: zip_xls)")
+    argParser.add_argument("--engine", default='rows',
+                           choices=sorted(redcap2xlsform.converterFromEngine),
+                           help="Conversion engine (default: rows)")
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    for name, size in measureObjects().items():
+        print('{:>13}: {:4} B'.format(name, size))
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        for size in args.sizes:
+            filename = os.path.join(tempDir, 'dictionary_{}.csv'.format(size))
+            generateDictionary(filename, size)
+            measured = measureMemory(filename, args.mode, args.engine)
+            print('{:>7} rows {:>7} choices: peak {:8.1f} MiB ({:6.0f} B/row), '
+                  'retained {:8.1f} MiB ({:6.0f} B/row)'.format(
+                      size, measured['choices'],
+                      measured['peak'] / 2 ** 20, measured['peak'] / size,
+                      measured['retained'] / 2 ** 20, measured['retained'] / size))
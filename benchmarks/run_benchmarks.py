@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Times stages of REDCap to XLSForm conversion on synthetic data dictionaries.
+
+Results are saved as JSON and compared against a stored baseline, stages
+slower or using more memory than the baseline allows are reported as
+regressions.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redcap2xlsform
+from generate_redcap import generateDictionary
+
+
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+stages = ['readRedcapFile', '_separateForms', 'convert', 'write']
+
+
+def runStages(filename, savefile, outputFormat='xls'):
+    """Runs conversion of the file stage by stage, yields names and functions of stages."""
+    state = {}
+
+    def read():
+        state['content'] = redcap2xlsform.readRedcapFile(filename)
+
+    def separate():
+        converter = redcap2xlsform.Converter(state['content'], 'single_xls', [])
+        converter.forms = converter._separateForms(state['content'])
+        state['converter'] = converter
+
+    def convert():
+        state['converted'] = state['converter'].convert()
+
+    def write():
+        writer = redcap2xlsform.writerFromFormat[outputFormat]
+        writer(savefile, 'zip_xls').write(state['converted'])
+
+    return list(zip(stages, [read, separate, convert, write]))
+
+
+def measure(filename, savefile, repeat, outputFormat='xls'):
+    """Returns best time and peak memory of every stage."""
+    results = {stage: {'seconds': None, 'peakMemory': None} for stage in stages}
+
+    for _ in range(repeat):
+        for stage, function in runStages(filename, savefile, outputFormat):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = results[stage]['seconds']
+            results[stage]['seconds'] = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    for stage, function in runStages(filename, savefile, outputFormat):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        results[stage]['peakMemory'] = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns descriptions of stages that regressed against baseline."""
+    regressions = []
+    for size, sizeResults in results.items():
+        for stage, measured in sizeResults.items():
+            expected = baseline.get(size, {}).get(stage)
+            if not expected:
+                continue
+            for metric in ('seconds', 'peakMemory'):
+                limit = expected[metric] * (1 + tolerance)
+                if measured[metric] > limit:
+                    regressions.append('{} rows, {}: {} {:.4g} > {:.4g}'.format(
+                        size, stage, metric, measured[metric], expected[metric]))
+    return regressions
+
+
+def parseArgs():
+    """Returns parsed arguments of benchmarks."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--sizes", type=int, nargs='*', default=[1000, 10000, 100000],
+                           help="Numbers of rows of generated dictionaries")
+    argParser.add_argument("--repeat", type=int, default=3,
+                           help="Number of timed runs, the best one is reported")
+    argParser.add_argument("-f", "--format", default='xls',
+                           choices=sorted(redcap2xlsform.writerFromFormat),
+                           help="Format of written forms (default: xls)")
+    argParser.add_argument("-o", "--output", default='benchmark_results.json',
+                           help="JSON file to save results to")
+    argParser.add_argument("--baseline", default=defaultBaseline,
+                           help="JSON file with baseline results to compare with")
+    argParser.add_argument("--tolerance", type=float, default=0.2,
+                           help="Allowed relative slowdown against baseline (default: 0.2)")
+    argParser.add_argument("--save-baseline", action='store_true',
+                           help="Save results as the new baseline")
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tempDir:
+        for size in args.sizes:
+            filename = os.path.join(tempDir, 'dictionary_{}.csv'.format(size))
+            savefile = os.path.join(tempDir, 'dictionary_{}.zip'.format(size))
+            generateDictionary(filename, size)
+            results[str(size)] = measure(filename, savefile, args.repeat, args.format)
+
+            for stage, measured in results[str(size)].items():
+                print('{:>7} rows {:>15}: {:8.3f}s {:10.1f} rows/s {:8.1f} MiB'.format(
+                    size, stage, measured['seconds'], size / measured['seconds'],
+                    measured['peakMemory'] / 2 ** 20))
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        exit(0)
+
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare with, save one with --save-baseline')
+        exit(0)
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('Regression: ' + regression)
+    exit(1 if regressions else 0)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Measures import time of the scripts at startup and enforces a budget.
+
+Every command is run with python -X importtime. Total time of imports
+done by the command, without those done by the interpreter itself, is
+compared with the budget, and heavy dependencies which the command does
+not need must not appear at all. Conversion of a form with plain text
+labels only is measured too, it must not import html2text. Exits with
+status 1 if any command is over budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavyModules = ['xlwt', 'xlsxwriter', 'html2text', 'pandas', 'xlrd', 'zipfile', 'csv']
+conversionModules = ['xlwt', 'zipfile', 'csv']
+plainLabelsForm = [['Variable / Field Name', 'Form Name', 'Field Type', 'Field Label'],
+                   ['record_id', 'visit', 'text', 'Record ID'],
+                   ['weight', 'visit', 'text', 'Weight (kg)'],
+                   ['smoker', 'visit', 'yesno', 'Does the patient smoke?']]
+
+
+def makeCommands(workDir):
+    """Returns measured commands with heavy modules they must not import."""
+    import csv
+
+    script = os.path.join(repoDir, 'redcap2xlsform.py')
+    formPath = os.path.join(workDir, 'plain_labels.csv')
+    with open(formPath, 'w', newline='') as file:
+        csv.writer(file).writerows(plainLabelsForm)
+    conversion = [script, formPath, '-s', os.path.join(workDir, 'plain_labels.zip'),
+                  '--no-cache']
+    conversionHeavyModules = [module for module in heavyModules
+                              if module not in conversionModules]
+    return [('import redcap2xlsform', ['-c', 'import redcap2xlsform'], heavyModules),
+            ('redcap2xlsform.py --help', [script, '--help'], heavyModules),
+            ('convert plain labels', conversion, conversionHeavyModules),
+            ('import split_xls_sheets', ['-c', 'import split_xls_sheets'], heavyModules)]
+
+
+def measureImports(arguments, cacheDir, ignoredModules=()):
+    """Returns total import time in milliseconds and names of imported modules.
+
+    Modules from ignoredModules are not counted in the total."""
+    env = dict(os.environ, PYTHONPATH=repoDir)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    process = subprocess.run([sys.executable, '-X', 'importtime',
+                              '-X', 'pycache_prefix=' + cacheDir] + arguments,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True, env=env, cwd=repoDir)
+
+    total = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, package = line[len('import time:'):].split('|')
+        modules.add(package.strip())
+        if not package.startswith('  ') and package.strip() not in ignoredModules:
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def parseArgs():
+    """Returns parsed arguments of the benchmark."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--budget-ms", type=float, default=40.0,
+                           help="Allowed total import time of every command (default: 40)")
+    argParser.add_argument("--repeat", type=int, default=5,
+                           help="Number of runs, the best one is reported")
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as cacheDir:
+        measureImports(['-c', 'pass'], cacheDir)
+        interpreterModules = measureImports(['-c', 'pass'], cacheDir)[1]
+
+        for name, arguments, forbiddenModules in makeCommands(cacheDir):
+            measureImports(arguments, cacheDir)
+            runs = [measureImports(arguments, cacheDir, interpreterModules)
+                    for _ in range(args.repeat)]
+            milliseconds = min(run[0] for run in runs)
+            heavy = sorted(set(forbiddenModules) & runs[0][1])
+
+            print('{:<28} {:8.1f} ms'.format(name, milliseconds))
+            if milliseconds > args.budget_ms:
+                failures.append('{} takes {:.1f} ms, budget is {:.1f} ms'.format(
+                    name, milliseconds, args.budget_ms))
+            if heavy:
+                failures.append('{} imports {}'.format(name, ', '.join(heavy)))
+
+    for failure in failures:
+        print('Over budget: ' + failure)
+    exit(1 if failures else 0)
@@ -1,30 +1,53 @@
 #!/usr/bin/env python3
 """This module converts redcap form files into XLSForm which can be used
 in kobotoolbox.
+
+Heavy dependencies (xlwt, xlsxwriter, html2text) and modules needed only
+by some modes are imported where they are used, to keep startup fast.
 """
-import csv
+import functools
+import itertools
 import re
 import argparse
-import zipfile
+import collections
+import contextlib
+import glob
+import io
+import json
+import sys
+import time
+import tracemalloc
 import os
 
-import xlwt
-import html2text
-
 
 class ColumnToCopyDoesNotExistException(Exception):
     def __init__(self, column):
         Exception.__init__(self, 'Column to copy "{}" does not exist in REDCap file!'.format(column))
         self.column = column
 
+    def __reduce__(self):
+        return (type(self), (self.column,))
+
 
 class CrossFormsReferenceException(Exception):
     def __init__(self, message):
         Exception.__init__(self, message)
 
 
+class ExpressionBudgetExceededException(Exception):
+    def __init__(self, field, column, reason):
+        Exception.__init__(self, 'Cannot convert "{}" of field "{}": {}'.format(column, field, reason))
+        self.field = field
+        self.column = column
+        self.reason = reason
+
+    def __reduce__(self):
+        return (type(self), (self.field, self.column, self.reason))
+
+
 class NameConverter:
     """Holds variable name from redcap file."""
+    __slots__ = ('name',)
     def __init__(self, name):
         self.name = name
 
@@ -35,6 +58,7 @@ class NameConverter:
 
 class TypeConverter:
     """Holds variable type from redcap type."""
+    __slots__ = ('type_', 'validation')
     convertFromTypeLookup = {'descriptive': 'note', 'notes': 'text', 'calc': 'calculate'}
     convertFromTypeWithChoicesLookup = {'radio': 'select_one ',
                                         'checkbox': 'select_multiple ',
@@ -68,6 +92,11 @@ class TypeConverter:
         else:
             return self._convertTextOrNoMatch()
 
+    def dependsOnListNumber(self):
+        """Returns whether converted type contains number of choices list."""
+        return not self._isYesNo() and not self._isConvertableFromType() \
+            and self._isConvertibleFromTypeWithChoices()
+
     def _isYesNo(self):
         return self.type_ == 'yesno'
 
@@ -85,11 +114,12 @@ class TypeConverter:
 
     def _convertFromTypeWithChoices(self, listNumber):
         typeBody = self.convertFromTypeWithChoicesLookup[self.type_]
-        type_ = typeBody + self._makeListName(listNumber)
+        type_ = sys.intern(typeBody + self._makeListName(listNumber))
         return type_, self.incrementListNumber
 
-    def _makeListName(self, listNumber):
-        return 'list_' + str(listNumber)
+    @staticmethod
+    def _makeListName(listNumber):
+        return sys.intern('list_' + str(listNumber))
 
     def _isConvertibleFromTypeAndValidation(self):
         return self.validation in self.convertFromTypeAndValidationLookup
@@ -104,10 +134,47 @@ class TypeConverter:
 
 class LabelConverter:
     """Holds variable label from redcap file."""
+    __slots__ = ('label', 'name')
+    plainTextRegex = r"[^\W\d_](?:[^\W_]|[,?'\"():;/%=@$.+-]| (?! ))*"
+    plainTextMaxLength = 70
+    defaultCacheSize = 1024
+    _cacheSize = defaultCacheSize
+    _convertCached = None
+
     def __init__(self, label, name):
         self.label = label
         self.name = name
 
+    @classmethod
+    def configureCache(cls, size):
+        """Sets number of converted labels kept in cache, None for unbounded.
+
+        The cache is created on first label needing conversion, so html2text
+        is not imported for forms with plain text labels only.
+        """
+        cls._cacheSize = size
+        cls._convertCached = None
+
+    @classmethod
+    def cacheInfo(cls):
+        """Returns hits and misses of converted labels cache."""
+        return cls._getConvertCached().cache_info()
+
+    @classmethod
+    def _getConvertCached(cls):
+        if cls._convertCached is None:
+            import html2text
+            cls._convertCached = staticmethod(
+                functools.lru_cache(maxsize=cls._cacheSize)(html2text.html2text))
+        return cls._convertCached
+
+    @classmethod
+    def isPlainText(cls, label):
+        """Returns whether label converts to itself, with no markup, entities or wrapping."""
+        return len(label) <= cls.plainTextMaxLength and \
+            not label.endswith(' ') and \
+            re.fullmatch(cls.plainTextRegex, label) is not None
+
     def convertToXLS(self):
         """Converts label to XLSForm format and returns it."""
         if self.label:
@@ -116,7 +183,9 @@ class LabelConverter:
             return self._convertName()
 
     def _convertLabel(self):
-        convertedLabel = html2text.html2text(self.label)
+        if self.isPlainText(self.label):
+            return self.label + '\n\n'
+        convertedLabel = self._getConvertCached()(self.label)
         return convertedLabel
 
     def _convertName(self):
@@ -125,6 +194,7 @@ class LabelConverter:
 
 class ConstraintConverter:
     """Holds information about variable constraints from redcap file."""
+    __slots__ = ('min_', 'max_')
     lessThanStr = '(. <= {})'
     greaterThanStr = '(. >= {})'
 
@@ -178,54 +248,80 @@ class ConstraintConverter:
 
 class RelevantConverter:
     """Holds expression from redcap file whether or not to show question."""
-    singleVariableRegex = r"\[(\w+)\]\s*([!<>=]{,2})\s*([\'\"]?)(\w*)[\'\"]?"
-    singleVariableSubstituteRegex = r"${\1} \2 \3\4\3"
-    arrayRegex = r"\[(\w+)\((\w+)\)\]\s*([!=]{,2})\s*[\'\"]?(\w*)[\'\"]?"
+    __slots__ = ('expression',)
+    tokenRegex = r"""(?x)
+        \[(?P<array>\w+)\((?P<item>\w+)\)\]
+            (?:\s*(?P<arrayOperator><>|!=|==?)\s*[\'\"]?(?P<arrayValue>\w*)[\'\"]?)?
+      | \[(?P<variable>\w+)\]
+            (?:\s*(?P<operator>[!<>=]{1,2})\s*(?P<quote>[\'\"]?)(?P<value>\w*)[\'\"]?)?
+      | (?P<different><>)
+      | (?P<word>\w+)
+    """
+    singleVariableSubstitute = "${{{}}}"
+    comparisonSubstitute = "${{{}}} {} {}{}{}"
     arraySubstitute = "selected('{}','{}')"
+    logicalOperators = ('or', 'and')
 
     def __init__(self, expression):
         self.expression = expression
 
     def convertToXLS(self):
         """Converts axpression to XLSForm format and returns it."""
-        singleVariablesConverted = re.sub(self.singleVariableRegex,
-                                          self.singleVariableSubstituteRegex,
-                                          self.expression)
-
-        arraysConverted = self.convertArrays(singleVariablesConverted)
-
-        differentConverted = re.sub(r"<>",
-                                    r"!=",
-                                    arraysConverted)
-        orConverted = re.sub(r"(?i)or",
-                             r"or",
-                             differentConverted)
-        andConverted = re.sub(r"(?i)and",
-                              r"and",
-                              orConverted)
-        allConverted = andConverted
-        return allConverted
-
-    def convertArrays(self, text):
-        converted = text
-        while re.search(self.arrayRegex, converted):
-            match = re.search(self.arrayRegex, converted)
-            operator = match.group(3)
-            value = match.group(4)[-1]  #sometimes values are not just 1 or 0 so we will check only last character
-            array = match.group(1)
-            item = match.group(2)
-            substitute = self.arraySubstitute.format(array, item)
-            if (operator == '=' and value == '0') or (operator == '!=' and value == '1'):
-                substitute = 'not(' + substitute + ')'
-            converted = re.sub(self.arrayRegex,
-                                     substitute,
-                                     converted,
-                                     count = 1)
-        return converted
+        return self.translate(self.expression)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def translate(expression):
+        """Translates branching logic to XLSForm in a single pass over its tokens.
+
+        Results are memoized, because the same conditions repeat across fields."""
+        return re.sub(RelevantConverter.tokenRegex, RelevantConverter._translateToken, expression)
+
+    @staticmethod
+    def _translateToken(match):
+        if match.group('array'):
+            return RelevantConverter._translateArray(match)
+        elif match.group('variable'):
+            return RelevantConverter._translateVariable(match)
+        elif match.group('different'):
+            return '!='
+        else:
+            return RelevantConverter._translateWord(match.group('word'))
+
+    @staticmethod
+    def _translateArray(match):
+        operator = match.group('arrayOperator')
+        value = match.group('arrayValue') or ''
+        value = value[-1:]  #sometimes values are not just 1 or 0 so we will check only last character
+        substitute = RelevantConverter.arraySubstitute.format(match.group('array'), match.group('item'))
+        if (operator in ('=', '==') and value == '0') or (operator in ('!=', '<>') and value == '1'):
+            substitute = 'not(' + substitute + ')'
+        return substitute
+
+    @staticmethod
+    def _translateVariable(match):
+        operator = match.group('operator')
+        if not operator:
+            return RelevantConverter.singleVariableSubstitute.format(match.group('variable'))
+
+        if operator == '<>':
+            operator = '!='
+        return RelevantConverter.comparisonSubstitute.format(match.group('variable'),
+                                                             operator,
+                                                             match.group('quote'),
+                                                             match.group('value'),
+                                                             match.group('quote'))
+
+    @staticmethod
+    def _translateWord(word):
+        if word.lower() in RelevantConverter.logicalOperators:
+            return word.lower()
+        return word
 
 
 class RequiredConverter:
     """Holds informations whether variable is required."""
+    __slots__ = ('required',)
     def __init__(self, required):
         self.required = required
 
@@ -241,62 +337,76 @@ class RequiredConverter:
 
 
 class ChoicesConverter:
-    """Holds information about available choices to question."""
+    """Holds information about available choices to question.
+
+    Definitions of choices are parsed once into tuples of interned names and
+    labels, shared by all questions with the same definition.
+    """
+    __slots__ = ('type_', 'choices', 'listName')
     def __init__(self, type_, choices):
         self.type_ = type_
         if type_ != 'calculate':
-            self.choices = self._separateChoices(choices)
-            self.listName = self._extractListName(type_)
+            self.choices = choices
+            self.listName = self.extractListName(type_)
 
-    def _separateChoices(self, choices):
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def parse(choices):
+        """Returns names and labels of choices and key of their set, for any list order."""
         if choices:
-            return choices.split('|')
+            parsed = tuple(ChoicesConverter._splitChoice(choice) for choice in choices.split('|'))
         else:
-            return []
+            parsed = ()
+        return parsed, tuple(sorted(parsed))
 
-    def _extractListName(self, type_):
+    @staticmethod
+    def extractListName(type_):
+        """Returns name of choices list from XLSForm type or None if it has no list."""
         splittedType = type_.split(' ')
         if len(splittedType) == 2:
-            return splittedType[1]
+            return sys.intern(splittedType[1])
         else:
             return None
 
     def convertToXLS(self):
         """Converts information to XLSForm format and returns it."""
-        if self.type_ != 'calculate':
-            convertedChoices = []
-
-            for choice in self.choices:
-                convertedChoice = self._convertChoice(choice)
-                convertedChoices.append(convertedChoice)
+        parsed, _ = self.parseToXLS()
+        return self.makeChoices(self.listName, parsed)
 
-            return convertedChoices
+    def parseToXLS(self):
+        """Returns parsed choices and key of their set without creating XLSChoice objects."""
+        if self.type_ != 'calculate':
+            return self.parse(self.choices)
 
-        return []
+        return (), ()
 
-    def _convertChoice(self, choice):
-        name, label = self._splitChoice(choice)
-        convertedChoice = XLSChoice(self.listName, name, label)
-        return convertedChoice
+    @staticmethod
+    def makeChoices(listName, parsed):
+        """Returns XLSChoice objects of parsed choices in list with given name."""
+        return [XLSChoice(listName, name, label) for name, label in parsed]
 
-    def _splitChoice(self, choice):
+    @staticmethod
+    def _splitChoice(choice):
         if ',' in choice:
             splittedChoice = choice.split(',')
         elif ':' in choice:
             splittedChoice = choice.split(':')
         else:
             raise Exception('Cannot read choice in this format: ' + choice)
-        name = splittedChoice[0].strip()
-        label = splittedChoice[1].strip()
+        name = sys.intern(splittedChoice[0].strip())
+        label = sys.intern(splittedChoice[1].strip())
         return name, label
 
 
 class CalculationsConverter:
-    """Converts calculations from redcap file to XLSForm format."""
-    singleVariableRegex = r"\[(\w+)\]"
-    singleVariableSubstituteRegex = r"${\1}"
-    arrayRegex = r"\[(\w+)\((\w+)\)\]"
-    arraySubstituteRegex = r"selected(${\1},'\2')"
+    """Converts calculations from redcap file to XLSForm format.
+
+    Variables and arrays are translated in a single pass over expression.
+    """
+    __slots__ = ('type_', 'expression')
+    variableRegex = r"\[(\w+)(?:\((\w+)\))?\]"
+    singleVariableSubstitute = "${{{}}}"
+    arraySubstitute = "selected(${{{}}},'{}')"
 
     def __init__(self, type_, expression):
         self.type_ = type_
@@ -306,19 +416,27 @@ class CalculationsConverter:
     def convertToXLS(self):
         """Converts axpression to XLSForm format and returns it."""
         if self.type_ == 'calculate':
-            singleVariableConverted = re.sub(self.singleVariableRegex,
-                                             self.singleVariableSubstituteRegex,
-                                             self.expression)
-            singleAndArraysConverted = re.sub(self.arrayRegex,
-                                              self.arraySubstituteRegex,
-                                              singleVariableConverted)
-            return singleAndArraysConverted
+            return self.translate(self.expression)
 
         return ''
 
+    @staticmethod
+    def translate(expression):
+        """Translates calculation to XLSForm."""
+        return re.sub(CalculationsConverter.variableRegex,
+                      CalculationsConverter._translateVariable,
+                      expression)
+
+    @staticmethod
+    def _translateVariable(match):
+        if match.group(2) is None:
+            return CalculationsConverter.singleVariableSubstitute.format(match.group(1))
+        return CalculationsConverter.arraySubstitute.format(match.group(1), match.group(2))
+
 
 class DeafultsConverter:
     """Converts default values for questions from redcap file to XLSForm format."""
+    __slots__ = ('annotation',)
     defaultsRegex = r"(?i)@default\s*=\s*[\'\"]?([^\'\"]*)[\'\"]?"
 
     def __init__(self, annotation):
@@ -336,6 +454,7 @@ class DeafultsConverter:
 
 class ReadOnlyConverter:
     """Converts hidden values from redcap file to read only in XLSForm format."""
+    __slots__ = ('annotation',)
     readOnlyRegex = r"(?i)@hidden"
 
     def __init__(self, annotation):
@@ -352,6 +471,7 @@ class ReadOnlyConverter:
 
 class HintsConverter:
     """Converts hints from redcap file to XLSForm format."""
+    __slots__ = ('hint',)
     def __init__(self, hint):
         self.hint = hint
 
@@ -362,9 +482,7 @@ class HintsConverter:
 
 class XLSChoice:
     """Holds information about available choices to question in XLSForm format."""
-    listName = ''
-    name = ''
-    label = ''
+    __slots__ = ('listName', 'name', 'label')
 
     def __init__(self, listName, name, label):
         self.listName = listName
@@ -373,33 +491,149 @@ class XLSChoice:
 
 
 class XLSContent:
-    """Holds content of file in XLSForm format."""
-    name = ''
-    headers = []
-    questions = []
-    choices = []
+    """Holds content of file in XLSForm format.
+
+    Rendered holds workbook bytes of the form when it was found in cache,
+    cacheKey the key to store the workbook under after it is rendered.
+    """
+    __slots__ = ('name', 'headers', 'questions', 'choices', 'rendered', 'cacheKey')
 
-    def __init__(self, name, headers, questions, choices):
+    def __init__(self, name, headers, questions, choices, rendered=None, cacheKey=None):
         self.name = name
         self.headers = headers
         self.questions = questions
         self.choices = choices
+        self.rendered = rendered
+        self.cacheKey = cacheKey
 
 
 class RedcapContent:
     """Holds content of file in redcap format."""
-    name = ''
-    headers = []
-    questions = []
+    __slots__ = ('name', 'headers', 'questions')
 
-    def __init__(self, name='', headers=[], questions=[]):
+    def __init__(self, name='', headers=None, questions=None):
         self.name = name
+        self.headers = headers if headers is not None else []
+        self.questions = questions if questions is not None else []
+
+
+class FormIndex:
+    """Splits content of redcap file into forms and indexes their variables.
+
+    Scanning rows records the form defining every variable and every
+    variable referred to in branching logic or calculations. Once all rows
+    are scanned, references to variables not defined earlier in the same
+    form are known all at once, and forms referring to each other can be
+    merged into groups of dependent forms.
+    """
+    variableRegex = re.compile(r"\[(\w+)(?:\(\w+\))?\]")
+
+    def __init__(self, headers):
         self.headers = headers
-        self.questions = questions
+        self.nameIndex = headers.index('Variable / Field Name')
+        self.typeIndex = headers.index('Field Type')
+        self.branchIndex = headers.index('Branching Logic (Show field only if...)')
+        self.calcIndex = headers.index('Choices, Calculations, OR Slider Labels')
+        self.formNameIndex = headers.index('Form Name')
+        self.formCount = 0
+        self.variableForms = {}
+        self.references = []
+
+    def scan(self, rows):
+        """Yields forms of rows in RedcapContent, indexing their variables."""
+        rows = iter(rows)
+        firstRow = next(rows, None)
+        if firstRow is None:
+            return
+
+        currentName = firstRow[self.formNameIndex]
+        currentForm = []
+        currentVariables = set()
+        for i, row in enumerate(itertools.chain([firstRow], rows)):
+            if row != []:
+                formName = row[self.formNameIndex]
+                if formName != currentName and formName != '':
+                    yield RedcapContent(currentName, self.headers, currentForm)
+                    self.formCount += 1
+                    currentName = formName
+                    currentForm = []
+                    currentVariables = set()
+
+                expression = row[self.branchIndex]
+                if row[self.typeIndex] == 'calc':
+                    expression += ' ' + row[self.calcIndex]
+                for variable in self.variableRegex.findall(expression):
+                    if variable not in currentVariables:
+                        self.references.append((i, row, variable, self.formCount))
+
+                name = row[self.nameIndex]
+                currentVariables.add(name)
+                self.variableForms.setdefault(name, self.formCount)
+                currentForm.append(row)
+
+        yield RedcapContent(currentName, self.headers, currentForm)
+        self.formCount += 1
+
+    def dependencies(self):
+        """Returns pairs of forms where the first refers to variable of the second."""
+        return {(form, self.variableForms[variable])
+                for _, _, variable, form in self.references
+                if self.variableForms.get(variable, form) != form}
+
+    def groups(self):
+        """Returns lists of numbers of forms connected by references, in order of forms."""
+        parents = list(range(self.formCount))
+
+        def find(form):
+            while parents[form] != form:
+                parents[form] = parents[parents[form]]
+                form = parents[form]
+            return form
+
+        for form, referred in self.dependencies():
+            first, second = sorted((find(form), find(referred)))
+            parents[second] = first
+
+        groups = collections.OrderedDict()
+        for form in range(self.formCount):
+            groups.setdefault(find(form), []).append(form)
+        return list(groups.values())
+
+    def mergeGroups(self, forms):
+        """Merges forms depending on each other, named after the first form of group."""
+        merged = []
+        for group in self.groups():
+            questions = []
+            for form in group:
+                questions.extend(forms[form].questions)
+            merged.append(RedcapContent(forms[group[0]].name, self.headers, questions))
+        return merged
+
+    def checkReferences(self, merged=False):
+        """Raises CrossFormsReferenceException listing all invalid references.
+
+        With merged forms only references to variables defined in another
+        form are valid.
+        """
+        msg = "Cannot divide into multiple forms, "\
+              "condition/calculation refers to other "\
+              "forms in line {line}:\n{row}"
+        messages = []
+        reportedLines = set()
+        for line, row, variable, form in self.references:
+            referred = self.variableForms.get(variable)
+            if merged and referred is not None and referred != form:
+                continue
+            if line not in reportedLines:
+                reportedLines.add(line)
+                messages.append(msg.format(line=line, row=repr(', '.join(row))))
+        if messages:
+            raise CrossFormsReferenceException('\n'.join(messages))
 
 
 class HeaderConverter:
     """Holds header from redcap file."""
+    __slots__ = ('header',)
     headersConversionLookup = {'Variable / Field Name': 'name',
                                'Field Type': 'type',
                                'Field Label': 'label',
@@ -422,73 +656,61 @@ class Converter:
                       XLSChoice('yes_no', 'no', 'No')]
     defaultHeaders = ['calculation', 'default', 'read_only']
 
-    def __init__(self, fileContent, mode, columnsToCopy):
+    def __init__(self, fileContent, mode, columnsToCopy, stream=False, cache=None,
+                 mergeForms=False):
         self._checkColumnsToCopyExistInHeaders(columnsToCopy, fileContent)
         self.columnsToCopy = columnsToCopy
-        if mode == 'zip_xls':
+        self.cache = cache
+        self.mergeForms = mergeForms
+        self.createdLists = 0
+        self.reusedLists = 0
+        if mode == 'zip_xls' and stream and not mergeForms:
+            self.forms = self._iterForms(fileContent)
+        elif mode == 'zip_xls':
             self.forms = self._separateForms(fileContent)
         else:
             self.forms = [fileContent]
 
     def convert(self):
         """Converts content of the file to XLSForm format and returns it."""
-        converted = []
-        for form in self.forms:
+        return list(self.iterConvert())
+
+    def iterConvert(self, forms=None):
+        """Converts forms one at a time and yields them in XLSForm format.
+
+        In stream mode each form is read from the file only when it is needed.
+        Forms found in cache are not converted, they carry rendered workbook.
+        Forms can also be given as an iterable, e.g. a queue filled by Pipeline.
+        """
+        for form in self.forms if forms is None else forms:
+            cacheKey = None
+            if self.cache is not None:
+                cacheKey = self.cache.makeKey(form)
+                rendered = self.cache.get(cacheKey)
+                if rendered is not None:
+                    yield XLSContent(form.name, [], [], [], rendered=rendered)
+                    continue
+
             convertedHeaders = self._convertHeaders(form.headers)
             convertedQuestions, convertedChoices = self._convertContent(form.questions, form.headers, convertedHeaders)
-            converted.append(XLSContent(form.name,
-                                        convertedHeaders,
-                                        convertedQuestions,
-                                        convertedChoices))
-
-        return converted
+            yield XLSContent(form.name,
+                             convertedHeaders,
+                             convertedQuestions,
+                             convertedChoices,
+                             cacheKey=cacheKey)
 
     def _separateForms(self, fileContent):
-        forms = []
-        nameIndex = fileContent.headers.index('Variable / Field Name')
-        typeIndex = fileContent.headers.index('Field Type')
-        branchIndex = fileContent.headers.index('Branching Logic (Show field only if...)')
-        calcIndex = fileContent.headers.index('Choices, Calculations, OR Slider Labels')
-        formNameIndex = fileContent.headers.index('Form Name')
-
-        currentName = fileContent.questions[0][formNameIndex]
-        currentForm = []
-        currentVariables = {}
-        for i, row in enumerate(fileContent.questions):
-            if row != []:
-                formName = row[formNameIndex]
-                if formName != currentName and formName != '':
-                    forms.append(RedcapContent(currentName, fileContent.headers, currentForm))
-                    currentName = formName
-                    currentForm = []
-                    currentVariables = {}
-
-                variables = self._extractVariables(row[branchIndex])
-                if row[typeIndex] == 'calc':
-                    variables += self._extractVariables(row[calcIndex])
-
-                for variable in variables:
-                    if variable not in currentVariables:
-                        printable_row = ', '.join(row)
-                        printable_row = repr(printable_row)
-                        msg = "Cannot divide into multiple forms, "\
-                              "condition/calculation refers to other "\
-                              "forms in line {line}:\n{row}"
-                        raise CrossFormsReferenceException(msg.format(line=i, row=printable_row))
-                currentVariables[row[nameIndex]] = True
-                currentForm.append(row)
-
-        forms.append(RedcapContent(currentName, fileContent.headers, currentForm))
-
+        index = FormIndex(fileContent.headers)
+        forms = list(index.scan(fileContent.questions))
+        if self.mergeForms:
+            forms = index.mergeGroups(forms)
+        index.checkReferences(merged=self.mergeForms)
         return forms
 
-    def _extractVariables(self, expression):
-        singleVariableRegex = r"\[(\w+)\]"
-        arrayRegex = r"\[(\w+)\(\w+\)\]"
-        variables = re.findall(singleVariableRegex, expression)
-        variables += re.findall(arrayRegex, expression)
-
-        return variables
+    def _iterForms(self, fileContent):
+        index = FormIndex(fileContent.headers)
+        yield from index.scan(fileContent.questions)
+        index.checkReferences()
 
     def _convertHeaders(self, redcapHeaders):
         convertedHeaders = []
@@ -507,50 +729,43 @@ class Converter:
         convertedQuestions = []
         convertedChoices = []
         listNumber = 0
-        listNumbermax = 0
-        choiceSets = []
+        choiceLists = ChoiceListIndex()
         convertedChoices += self.defaultChoices
         prevGroups = 0
+        plan = ColumnPlan(redcapHeaders, convertedHeaders, self.columnsToCopy)
 
         for i, row in enumerate(redcapQuestions):
             if not row:
                 continue
 
-            if row[redcapHeaders.index('Section Header')]:
+            sectionHeader = row[plan.sectionHeaderIndex]
+            if sectionHeader:
                 if prevGroups > 0:
                     convertedQuestions.append(self._endGroup(convertedHeaders))
-                convertedQuestions.append(self._beginGroup(convertedHeaders, prevGroups, row[redcapHeaders.index('Section Header')]))
+                convertedQuestions.append(self._beginGroup(convertedHeaders, prevGroups, sectionHeader))
                 prevGroups += 1
 
-            redcapRow = RowConverter(row, redcapHeaders,
-                                     convertedHeaders, listNumber,
-                                     self.columnsToCopy)
+            redcapRow = RowConverter(row, plan)
             questions, choices, listIncrement = redcapRow.convertToXLS()
 
+            isNewList = False
             if len(choices) > 0:
-                namesFromSet = sorted([c.name for c in choices])
-                if namesFromSet not in choiceSets:
-                    listNumber = listNumbermax
-                    listNumbermax += listIncrement
-                else:
-                    listNumber = choiceSets.index(namesFromSet)
+                listNumber, isNewList = choiceLists.findListNumber(redcapRow.choicesKey, listIncrement)
 
-            redcapRow = RowConverter(row, redcapHeaders,
-                                     convertedHeaders, listNumber,
-                                     self.columnsToCopy)
-            questions, choices, listIncrement = redcapRow.convertToXLS()
+            redcapRow.setListNumber(listNumber)
 
             if questions:
                 convertedQuestions.append(questions)
 
-            if len(choices) > 0:
-                if namesFromSet not in choiceSets:
-                    choiceSets.append(namesFromSet)
-                    convertedChoices += choices
+            if isNewList:
+                convertedChoices += redcapRow.makeChoices()
 
         if prevGroups > 0:
             convertedQuestions.append(self._endGroup(convertedHeaders))
 
+        self.createdLists += choiceLists.created
+        self.reusedLists += choiceLists.reused
+
         return convertedQuestions, convertedChoices
 
     def _beginGroup(self, headers, prevGroups, label):
@@ -571,185 +786,485 @@ class Converter:
                 raise ColumnToCopyDoesNotExistException(column)
 
 
+class ChoiceListIndex:
+    """Assigns numbers to choices lists, so that repeated sets of choices share one list."""
+    def __init__(self):
+        self.listNumbers = {}
+        self.nextListNumber = 0
+        self.created = 0
+        self.reused = 0
+
+    def findListNumber(self, key, listIncrement):
+        """Returns number of the list with given key of choices and whether it is a new list.
+
+        Key is the sorted tuple of names and labels from ChoicesConverter.parse.
+        """
+        listNumber = self.listNumbers.get(key)
+        if listNumber is not None:
+            self.reused += 1
+            return listNumber, False
+
+        listNumber = self.nextListNumber
+        self.nextListNumber += listIncrement
+        self.listNumbers[key] = listNumber
+        self.created += 1
+        return listNumber, True
+
+
+class ExpressionBudget:
+    """Limits length and conversion time of branching logic and calculations.
+
+    Expressions are translated in time linear in their length, so the length
+    limit bounds the time of any conversion. Expressions converted slower
+    than maxSeconds anyway are reported with their field too.
+    """
+    maxLength = 100000
+    maxSeconds = 1.0
+    relevantColumn = 'Branching Logic (Show field only if...)'
+    calculationsColumn = 'Choices, Calculations, OR Slider Labels'
+
+    @classmethod
+    def configure(cls, maxLength, maxSeconds):
+        """Sets limits of expression length in characters and conversion time in seconds."""
+        cls.maxLength = maxLength
+        cls.maxSeconds = maxSeconds
+
+    @classmethod
+    def checkLength(cls, field, column, expression):
+        """Raises ExpressionBudgetExceededException if expression is too long."""
+        if len(expression) > cls.maxLength:
+            raise ExpressionBudgetExceededException(
+                field, column, 'expression has {} characters, limit is {}'.format(
+                    len(expression), cls.maxLength))
+
+    @classmethod
+    def convert(cls, field, column, expression, translate):
+        """Returns expression translated by translate within limits of budget."""
+        cls.checkLength(field, column, expression)
+        start = time.perf_counter()
+        converted = translate(expression)
+        seconds = time.perf_counter() - start
+        if seconds > cls.maxSeconds:
+            raise ExpressionBudgetExceededException(
+                field, column, 'conversion took {:.2f}s, limit is {}s'.format(
+                    seconds, cls.maxSeconds))
+        return converted
+
+
+class ColumnPlan:
+    """Holds column slots and converters of a form compiled once for all its rows."""
+    redcapFields = [('name', 'Variable / Field Name'),
+                    ('type_', 'Field Type'),
+                    ('validation', 'Text Validation Type OR Show Slider Number'),
+                    ('label', 'Field Label'),
+                    ('lowerBound', 'Text Validation Min'),
+                    ('upperBound', 'Text Validation Max'),
+                    ('relevant', 'Branching Logic (Show field only if...)'),
+                    ('required', 'Required Field?'),
+                    ('choicesOrCalculations', 'Choices, Calculations, OR Slider Labels'),
+                    ('annotation', 'Field Annotation'),
+                    ('hint', 'Field Note')]
+
+    def __init__(self, redcapHeaders, convertedHeaders, columnsToCopy):
+        redcapHeaderIndex = self._indexHeaders(redcapHeaders)
+        XLSHeaderIndex = self._indexHeaders(convertedHeaders)
+
+        self.width = len(convertedHeaders)
+        self.sectionHeaderIndex = redcapHeaderIndex.get('Section Header')
+        self.fieldIndices = [(field, redcapHeaderIndex.get(header))
+                             for field, header in self.redcapFields]
+        self.typeSlot = XLSHeaderIndex.get('type')
+        self.converters = self._compileConverters(XLSHeaderIndex)
+        self.additionalSlots = [(XLSHeaderIndex.get(column), redcapHeaderIndex.get(column))
+                                for column in columnsToCopy]
+
+    def _indexHeaders(self, headers):
+        headerIndex = {}
+        for i, header in enumerate(headers):
+            headerIndex[header] = i
+        return headerIndex
+
+    def _compileConverters(self, XLSHeaderIndex):
+        optionalConverters = [('name', RowConverter._convertName),
+                              ('type', RowConverter._convertType),
+                              ('label', RowConverter._convertLabel),
+                              ('constraint', RowConverter._convertConstraint),
+                              ('relevant', RowConverter._convertRelevant),
+                              ('required', RowConverter._convertRequired),
+                              ('hint', RowConverter._convertHint)]
+        defaultConverters = [('calculation', RowConverter._convertCalculations),
+                             ('default', RowConverter._convertDefaults),
+                             ('read_only', RowConverter._convertReadOnly)]
+
+        converters = [(XLSHeaderIndex[header], converter)
+                      for header, converter in optionalConverters
+                      if header in XLSHeaderIndex]
+        converters.append((None, RowConverter._convertChoices))
+        converters += [(XLSHeaderIndex.get(header), converter)
+                       for header, converter in defaultConverters]
+        return converters
+
+
 class RowConverter:
     """Holds information about single row from redcap file."""
-    def __init__(self, row, redcapHeaders, convertedHeaders, listNumber, columnsToCopy):
+    __slots__ = tuple(field for field, _ in ColumnPlan.redcapFields) + \
+        ('row', 'plan', 'typeConverter', 'convertedRow', 'convertedType',
+         'parsedChoices', 'choicesKey', 'listIncrement', 'dependsOnListNumber')
+    def __init__(self, row, plan):
         self.row = row
-        self.redcapHeaders = redcapHeaders
-        self.convertedHeaders = convertedHeaders
-        self.listNumber = listNumber
-        self.columnsToCopy = columnsToCopy
-        self._processHeaders()
+        self.plan = plan
         self._processValues()
 
-    def _processHeaders(self):
-        self.redcapHeaderIndex = {}
-        self.XLSHeaderIndex = {}
-
-        for i, header in enumerate(self.redcapHeaders):
-            self.redcapHeaderIndex[header] = i
-
-        for i, header in enumerate(self.convertedHeaders):
-            self.XLSHeaderIndex[header] = i
-
     def _processValues(self):
-        self.name = self._getRedcapVal('Variable / Field Name')
-        self.type_ = self._getRedcapVal('Field Type')
-        self.validation = self._getRedcapVal('Text Validation Type OR Show Slider Number')
-        self.label = self._getRedcapVal('Field Label')
-        self.lowerBound = self._getRedcapVal('Text Validation Min')
-        self.upperBound = self._getRedcapVal('Text Validation Max')
-        self.relevant = self._getRedcapVal('Branching Logic (Show field only if...)')
-        self.required = self._getRedcapVal('Required Field?')
-        self.choicesOrCalculations = self._getRedcapVal('Choices, Calculations, OR Slider Labels')
-        self.annotation = self._getRedcapVal('Field Annotation')
-        self.hint = self._getRedcapVal('Field Note')
-        self.additional = {column: self._getRedcapVal(column) for column in self.columnsToCopy}
+        for field, index in self.plan.fieldIndices:
+            setattr(self, field, self._getRedcapVal(index))
 
     def convertToXLS(self):
-        """Converts row to XLSForm format and returns it."""
-        self.convertedRow = [''] * len(self.convertedHeaders)
-
-        if not self._isEmpty():
-            if self._hasXLSHeader('name'):
-                self._convertName()
-
-            if self._hasXLSHeader('type'):
-                self._convertType()
+        """Converts row to XLSForm format and returns it with parsed choices.
 
-            if self._hasXLSHeader('label'):
-                self._convertLabel()
+        List name of choices is resolved later with setListNumber, XLSChoice
+        objects are created with makeChoices only for new lists."""
+        self.convertedRow = [''] * self.plan.width
+        self.convertedType = None
+        self.parsedChoices = ()
+        self.choicesKey = ()
+        self.listIncrement = 0
+        self.dependsOnListNumber = False
 
-            if self._hasXLSHeader('constraint'):
-                self._convertConstraint()
-
-            if self._hasXLSHeader('relevant'):
-                self._convertRelevant()
-
-            if self._hasXLSHeader('required'):
-                self._convertRequired()
-
-            if self._hasXLSHeader('hint'):
-                self._convertHint()
+        if not self._isEmpty():
+            for slot, converter in self.plan.converters:
+                value = converter(self)
+                if slot is not None:
+                    self.convertedRow[slot] = value
 
-            self._convertChoices()
-            self._convertCalculations()
-            self._convertDefaults()
-            self._convertReadOnly()
             self._convertAdditional()
         else:
             self.convertedRow = ''
-            self.convertedChoices = []
-            self.listIncrement = 0
 
-        return self.convertedRow, self.convertedChoices, self.listIncrement
+        return self.convertedRow, self.parsedChoices, self.listIncrement
+
+    def setListNumber(self, listNumber):
+        """Puts list number into converted type."""
+        if self.dependsOnListNumber:
+            convertedType, _ = self.typeConverter.convertToXLS(listNumber)
+            self.convertedType = convertedType
+            self.convertedRow[self.plan.typeSlot] = convertedType
+
+    def makeChoices(self):
+        """Returns choices of the row in XLSForm format, in list named after converted type."""
+        listName = ChoicesConverter.extractListName(self.convertedType)
+        return ChoicesConverter.makeChoices(listName, self.parsedChoices)
 
     def _convertName(self):
         redcapName = NameConverter(self.name)
-        convertedName = redcapName.convertToXLS()
-        self._setXLSVal('name', convertedName)
+        return redcapName.convertToXLS()
 
     def _convertType(self):
-        redcapType = TypeConverter(self.type_, self.validation)
-        convertedType, increment = redcapType.convertToXLS(self.listNumber)
+        self.typeConverter = TypeConverter(self.type_, self.validation)
+        self.dependsOnListNumber = self.typeConverter.dependsOnListNumber()
+        convertedType, increment = self.typeConverter.convertToXLS(0)
         self.convertedType = convertedType
-        self._setXLSVal('type', convertedType)
         self.listIncrement = increment
+        return convertedType
 
     def _convertLabel(self):
         redcapLabel = LabelConverter(self.label, self.name)
-        convertedLabel = redcapLabel.convertToXLS()
-        self._setXLSVal('label', convertedLabel)
+        return redcapLabel.convertToXLS()
 
     def _convertConstraint(self):
         redcapConstraint = ConstraintConverter(self.lowerBound, self.upperBound)
-        convertedConstraint = redcapConstraint.convertToXLS()
-        self._setXLSVal('constraint', convertedConstraint)
+        return redcapConstraint.convertToXLS()
 
     def _convertRelevant(self):
-        redcapRelevant = RelevantConverter(self.relevant)
-        convertedRelevant = redcapRelevant.convertToXLS()
-        self._setXLSVal('relevant', convertedRelevant)
+        return ExpressionBudget.convert(self.name, ExpressionBudget.relevantColumn,
+                                        self.relevant, RelevantConverter.translate)
 
     def _convertRequired(self):
         redcapRequired = RequiredConverter(self.required)
-        convertedRequired = redcapRequired.convertToXLS()
-        self._setXLSVal('required', convertedRequired)
+        return redcapRequired.convertToXLS()
 
     def _convertCalculations(self):
-        redcapCalculations = CalculationsConverter(self.convertedType, self.choicesOrCalculations)
-        convertedCalculations = redcapCalculations.convertToXLS()
-        self._setXLSVal('calculation', convertedCalculations)
+        if self.convertedType != 'calculate':
+            return ''
+        return ExpressionBudget.convert(self.name, ExpressionBudget.calculationsColumn,
+                                        self.choicesOrCalculations,
+                                        CalculationsConverter.translate)
 
     def _convertDefaults(self):
         redcapDefaults = DeafultsConverter(self.annotation)
-        convertedDeafults = redcapDefaults.convertToXLS()
-        self._setXLSVal('default', convertedDeafults)
+        return redcapDefaults.convertToXLS()
 
     def _convertReadOnly(self):
         redcapReadOnly = ReadOnlyConverter(self.annotation)
-        convertedReadOnly = redcapReadOnly.convertToXLS()
-        self._setXLSVal('read_only', convertedReadOnly)
+        return redcapReadOnly.convertToXLS()
 
     def _convertHint(self):
         redcapHint = HintsConverter(self.hint)
-        convertedHint = redcapHint.convertToXLS()
-        self._setXLSVal('hint', convertedHint)
+        return redcapHint.convertToXLS()
 
     def _convertAdditional(self):
-        for column in self.additional:
-            self._setXLSVal(column, self.additional.get(column))
+        for slot, index in self.plan.additionalSlots:
+            self.convertedRow[slot] = self._getRedcapVal(index)
 
     def _convertChoices(self):
         redcapChoices = ChoicesConverter(self.convertedType, self.choicesOrCalculations)
-        self.convertedChoices = redcapChoices.convertToXLS()
-
-    def _hasXLSHeader(self, header):
-        return header in self.convertedHeaders
+        self.parsedChoices, self.choicesKey = redcapChoices.parseToXLS()
 
-    def _getRedcapVal(self, header):
-        index = self._getRedcapIndex(header)
+    def _getRedcapVal(self, index):
         if index < len(self.row):
             return self.row[index]
         else:
             return ''
 
-    def _setXLSVal(self, header, value):
-        index = self._getXLSIndex(header)
-        self.convertedRow[index] = value
-
-    def _getRedcapIndex(self, type_):
-        return self.redcapHeaderIndex.get(type_)
-
-    def _getXLSIndex(self, type_):
-        return self.XLSHeaderIndex.get(type_)
-
     def _isEmpty(self):
         redcapName = NameConverter(self.name)
         convertedName = redcapName.convertToXLS()
         return not convertedName
 
 
+class ColumnarConverter(Converter):
+    """Converts content of redcap file to XLSForm column by column with pandas.
+
+    Every column is converted on its own by the converter classes of the
+    row engine, so both engines share the rules of conversion and differ
+    only in how rows, groups and choices lists of a form are assembled.
+    Produces the same XLSContent as Converter, so it is used to cross-check
+    it. It is not faster: building a DataFrame for every form costs more
+    than converting whole columns saves.
+    """
+    def _convertContent(self, redcapQuestions, redcapHeaders, convertedHeaders):
+        import pandas
+
+        redcapHeaderIndex = {header: i for i, header in enumerate(redcapHeaders)}
+        XLSHeaderIndex = {header: i for i, header in enumerate(convertedHeaders)}
+        width = len(redcapHeaders)
+        frame = pandas.DataFrame([row[:width] + [''] * (width - len(row))
+                                  for row in redcapQuestions if row],
+                                 columns=range(width), dtype=object).fillna('')
+
+        def column(header):
+            index = redcapHeaderIndex.get(header)
+            if index is None:
+                return pandas.Series('', index=frame.index, dtype=object)
+            return frame[index]
+
+        fields = {field: column(header) for field, header in ColumnPlan.redcapFields}
+        names = fields['name']
+        types, dependsOnListNumber = self._convertTypes(fields['type_'], fields['validation'])
+
+        columns = {'name': names,
+                   'type': types,
+                   'label': self._mapColumns(LabelConverter, fields['label'], names),
+                   'constraint': self._mapColumns(ConstraintConverter, fields['lowerBound'],
+                                                  fields['upperBound']),
+                   'relevant': self._convertRelevant(names, fields['relevant']),
+                   'required': self._mapColumns(RequiredConverter, fields['required']),
+                   'hint': self._mapColumns(HintsConverter, fields['hint']),
+                   'calculation': self._convertCalculations(names, types,
+                                                            fields['choicesOrCalculations']),
+                   'default': self._mapColumns(DeafultsConverter, fields['annotation']),
+                   'read_only': self._mapColumns(ReadOnlyConverter, fields['annotation'])}
+        for header in self.columnsToCopy:
+            columns[header] = column(header)
+
+        converted = pandas.DataFrame(index=frame.index, columns=range(len(convertedHeaders)),
+                                     dtype=object).fillna('')
+        for header, values in columns.items():
+            if header in XLSHeaderIndex:
+                converted[XLSHeaderIndex[header]] = values
+        convertedRows = converted.values.tolist()
+
+        convertedChoices = list(self.defaultChoices)
+        self._convertChoices(convertedRows, convertedChoices, names.tolist(), types.tolist(),
+                             fields['type_'].tolist(), dependsOnListNumber.tolist(),
+                             fields['choicesOrCalculations'].tolist(),
+                             XLSHeaderIndex.get('type'))
+
+        convertedQuestions = []
+        prevGroups = 0
+        sectionHeaders = column('Section Header').tolist()
+        for name, sectionHeader, convertedRow in zip(names.tolist(), sectionHeaders, convertedRows):
+            if sectionHeader:
+                if prevGroups > 0:
+                    convertedQuestions.append(self._endGroup(convertedHeaders))
+                convertedQuestions.append(self._beginGroup(convertedHeaders, prevGroups, sectionHeader))
+                prevGroups += 1
+            if name:
+                convertedQuestions.append(convertedRow)
+
+        if prevGroups > 0:
+            convertedQuestions.append(self._endGroup(convertedHeaders))
+
+        return convertedQuestions, convertedChoices
+
+    def _mapColumns(self, converterClass, *columns):
+        """Returns column converted by converterClass from values of given columns."""
+        import pandas
+
+        converted = [converterClass(*values).convertToXLS() for values in zip(*columns)]
+        return pandas.Series(converted, index=columns[0].index, dtype=object)
+
+    def _convertTypes(self, types, validation):
+        import pandas
+
+        typeConverters = [TypeConverter(type_, validationType)
+                          for type_, validationType in zip(types, validation)]
+        converted = [typeConverter.convertToXLS(0)[0] for typeConverter in typeConverters]
+        dependsOnListNumber = [typeConverter.dependsOnListNumber()
+                               for typeConverter in typeConverters]
+        return (pandas.Series(converted, index=types.index, dtype=object),
+                pandas.Series(dependsOnListNumber, index=types.index, dtype=bool))
+
+    def _convertRelevant(self, names, expressions):
+        column = ExpressionBudget.relevantColumn
+        return expressions.combine(names, lambda expression, name: ExpressionBudget.convert(
+            name, column, expression, RelevantConverter.translate))
+
+    def _convertCalculations(self, names, types, expressions):
+        column = ExpressionBudget.calculationsColumn
+        isCalculation = types == 'calculate'
+        converted = expressions[isCalculation].combine(
+            names[isCalculation], lambda expression, name: ExpressionBudget.convert(
+                name, column, expression, CalculationsConverter.translate))
+        return converted.reindex(expressions.index, fill_value='')
+
+    def _convertChoices(self, convertedRows, convertedChoices, names, types, redcapTypes,
+                        dependsOnListNumber, choicesStrings, typeSlot):
+        listNumber = 0
+        choiceLists = ChoiceListIndex()
+        for i, name in enumerate(names):
+            if not name or types[i] == 'calculate':
+                continue
+            if not choicesStrings[i] and not dependsOnListNumber[i]:
+                continue
+
+            parsed, key = ChoicesConverter.parse(choicesStrings[i])
+            isNewList = False
+            if len(parsed) > 0:
+                listIncrement = 1 if dependsOnListNumber[i] else 0
+                listNumber, isNewList = choiceLists.findListNumber(key, listIncrement)
+
+            if dependsOnListNumber[i]:
+                listName = TypeConverter._makeListName(listNumber)
+                typeBody = TypeConverter.convertFromTypeWithChoicesLookup[redcapTypes[i]]
+                convertedRows[i][typeSlot] = sys.intern(typeBody + listName)
+            else:
+                listName = ChoicesConverter.extractListName(types[i])
+
+            if isNewList:
+                convertedChoices += ChoicesConverter.makeChoices(listName, parsed)
+
+        self.createdLists += choiceLists.created
+        self.reusedLists += choiceLists.reused
+
+
+converterFromEngine = {'rows': Converter, 'columnar': ColumnarConverter}
+
+
 class XLSWriter:
     """Writes content in XLSForm format to a file."""
-    def __init__(self, filename, mode):
-        self.path = os.path.dirname(filename)
-        self.path += '/'
+    extension = '.xls'
+
+    def __init__(self, filename, mode, jobs=1, compressLevel=None, cache=None,
+                 inMemory=False):
         self.filename = filename
         self.mode = mode
+        self.jobs = jobs
+        self.compressLevel = compressLevel
+        self.cache = cache
+        self.inMemory = inMemory
 
     def write(self, content):
-        """Writes content in XLSForm format to a file."""
+        """Writes content in XLSForm format to a file.
+
+        Filename can also be a binary file object to write to.
+        """
         if self.mode == "single_xls":
-            self._writeFile(self.filename, content[0])
+            self._writeSingle(next(iter(content)))
         else:
-            with zipfile.ZipFile(self.filename, 'w') as file:
+            self._writeZip(content)
+
+    def _writeZip(self, content):
+        """Writes forms to zip archive, removing the archive if any form fails."""
+        import zipfile
+
+        if self.compressLevel is None:
+            compression = zipfile.ZIP_STORED
+        else:
+            compression = zipfile.ZIP_DEFLATED
+
+        file = zipfile.ZipFile(self.filename, 'w', compression,
+                               compresslevel=self.compressLevel)
+        try:
+            with file:
+                if self.jobs > 1:
+                    self._writeZipParallel(file, content)
+                    return
+
                 for form in content:
-                    self._writeFile(form.name + '.xls', form)
-                    file.write(form.name + '.xls')
-                    os.remove(form.name + '.xls')
+                    file.writestr(form.name + self.extension, self._renderCached(form))
+        except Exception:
+            if isinstance(self.filename, str):
+                with contextlib.suppress(OSError):
+                    os.remove(self.filename)
+            raise
+
+    def _writeZipParallel(self, file, content):
+        """Renders workbooks in a pool of processes and adds them to zip in order of forms."""
+        import concurrent.futures
+
+        window = 2 * self.jobs
+        pending = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            for form in content:
+                if form.rendered is not None:
+                    rendered = concurrent.futures.Future()
+                    rendered.set_result(form.rendered)
+                else:
+                    rendered = executor.submit(self._renderFile, form)
+                pending.append((form.name, form.cacheKey, rendered))
+                if len(pending) >= window:
+                    self._writeRendered(file, *pending.popleft())
+
+            while pending:
+                self._writeRendered(file, *pending.popleft())
+
+    def _writeRendered(self, file, name, cacheKey, rendered):
+        data = rendered.result()
+        self._storeRendered(cacheKey, data)
+        file.writestr(name + self.extension, data)
+
+    def _writeSingle(self, content):
+        if self.cache is None:
+            self._writeFile(self.filename, content)
+            return
+
+        data = self._renderCached(content)
+        if isinstance(self.filename, str):
+            with open(self.filename, 'wb') as file:
+                file.write(data)
+        else:
+            self.filename.write(data)
+
+    def _renderCached(self, content):
+        if content.rendered is not None:
+            return content.rendered
+        data = self._renderFile(content)
+        self._storeRendered(content.cacheKey, data)
+        return data
+
+    def _storeRendered(self, cacheKey, data):
+        if self.cache is not None and cacheKey is not None:
+            self.cache.put(cacheKey, data)
+
+    def _renderFile(self, content):
+        buffer = io.BytesIO()
+        self._writeFile(buffer, content)
+        return buffer.getvalue()
 
     def _writeFile(self, filename, content):
+        import xlwt
+
         book = xlwt.Workbook()
         surveySheet = book.add_sheet('survey')
         choicesSheet = book.add_sheet('choices')
@@ -758,46 +1273,703 @@ class XLSWriter:
         book.save(filename)
 
     def _writeSurvey(self, sheet, headers, questions):
-        self._writeRow(0, headers, sheet)
+        writeRow = self._makeRowWriter(sheet)
+        writeRow(0, headers)
 
         for i, row in enumerate(questions):
-            self._writeRow(i + 1, row, sheet)
+            writeRow(i + 1, row)
 
     def _writeChoices(self, sheet, choices):
+        writeRow = self._makeRowWriter(sheet)
         choicesHeaders = ['list name', 'name', 'label']
-        self._writeRow(0, choicesHeaders, sheet)
+        writeRow(0, choicesHeaders)
 
         for i, choice in enumerate(choices):
-            sheet.write(i + 1, 0, choice.listName)
-            sheet.write(i + 1, 1, choice.name)
-            sheet.write(i + 1, 2, choice.label)
+            writeRow(i + 1, (choice.listName, choice.name, choice.label))
+
+    def _makeRowWriter(self, sheet):
+        """Returns function writing non-empty cells of a row of sheet in bulk.
+
+        Empty cells are skipped, as they read back the same as blank cells.
+        Only the first and the last cell go through xlwt's checks of column
+        bounds and style, cells between them are inserted directly with the
+        default style resolved once for the sheet.
+        """
+        from xlwt import Style
+        from xlwt.Cell import StrCell
+
+        book = sheet.get_parent()
+        styleIndex = book.add_style(Style.default_style)
+
+        def writeRow(rowNumber, row):
+            cells = [(j, item) for j, item in enumerate(row) if item]
+            if not cells:
+                return
+
+            sheetRow = sheet.row(rowNumber)
+            if any(not isinstance(item, str) for _, item in cells):
+                for j, item in cells:
+                    sheetRow.write(j, item)
+                return
+
+            sheetRow.set_cell_text(*cells[0])
+            if len(cells) > 1:
+                sheetRow.set_cell_text(*cells[-1])
+            # Row.insert_cell and StrCell are internals of xlwt, bypassing
+            # Row.write and its per cell checks. They are used as in xlwt
+            # 1.3.0, the version pinned in setup.py.
+            for j, item in cells[1:-1]:
+                sheetRow.insert_cell(j, StrCell(rowNumber, j, styleIndex, book.add_str(item)))
+
+        return writeRow
+
+
+class XLSXWriter(XLSWriter):
+    """Writes content in XLSForm format to a .xlsx file.
+
+    Rows are flushed to temporary files as soon as they are written, so
+    memory usage does not grow with the size of a form. With inMemory,
+    workbooks are kept in memory and touch no disk.
+    """
+    extension = '.xlsx'
+    workbookOptions = {'strings_to_numbers': False,
+                       'strings_to_formulas': False,
+                       'strings_to_urls': False}
+
+    def _writeFile(self, filename, content):
+        import xlsxwriter
+
+        if self.inMemory:
+            options = dict(self.workbookOptions, in_memory=True)
+        else:
+            options = dict(self.workbookOptions, constant_memory=True)
+        with xlsxwriter.Workbook(filename, options) as book:
+            surveySheet = book.add_worksheet('survey')
+            choicesSheet = book.add_worksheet('choices')
+            self._writeSurvey(surveySheet, content.headers, content.questions)
+            self._writeChoices(choicesSheet, content.choices)
+
+    def _makeRowWriter(self, sheet):
+        def writeRow(rowNumber, row):
+            sheet.write_row(rowNumber, 0, row)
+
+        return writeRow
+
+
+class CSVWriter(XLSWriter):
+    """Writes content in XLSForm format as survey.csv and choices.csv zipped per form.
+
+    Rows are written to the CSV files as they are taken from content, with
+    no workbook encoding, for machines consuming converted forms.
+    """
+    extension = '.zip'
+
+    def _writeFile(self, filename, content):
+        import csv
+        import zipfile
+
+        with zipfile.ZipFile(filename, 'w') as file:
+            for sheetName, rows in self._iterSheets(content):
+                with file.open(sheetName + '.csv', 'w') as member:
+                    text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+                    csv.writer(text).writerows(rows)
+                    text.flush()
+                    text.detach()
+
+    def _iterSheets(self, content):
+        survey = itertools.chain([content.headers], content.questions)
+        choices = itertools.chain([['list name', 'name', 'label']],
+                                  ((choice.listName, choice.name, choice.label)
+                                   for choice in content.choices))
+        return [('survey', survey), ('choices', choices)]
+
+
+class JSONWriter(CSVWriter):
+    """Writes content in XLSForm format as a JSON document.
 
-    def _writeRow(self, rowNumber, row, sheet):
-        for j, item in enumerate(row):
-            sheet.write(rowNumber, j, item)
+    Document holds headers and rows of survey and choices sheets, rows are
+    serialized one at a time as they are taken from content.
+    """
+    extension = '.json'
 
+    def _writeFile(self, filename, content):
+        if isinstance(filename, str):
+            with open(filename, 'w', encoding='utf-8') as file:
+                self._writeDocument(file, content)
+            return
+
+        text = io.TextIOWrapper(filename, encoding='utf-8')
+        self._writeDocument(text, content)
+        text.flush()
+        text.detach()
+
+    def _writeDocument(self, file, content):
+        file.write('{"name": ' + json.dumps(content.name))
+        for sheetName, rows in self._iterSheets(content):
+            rows = iter(rows)
+            file.write(', "{}": {{"headers": {}, "rows": ['.format(sheetName,
+                                                                  json.dumps(list(next(rows)))))
+            for i, row in enumerate(rows):
+                if i > 0:
+                    file.write(', ')
+                file.write(json.dumps(row))
+            file.write(']}')
+        file.write('}\n')
+
+
+writerFromFormat = {'xls': XLSWriter, 'xlsx': XLSXWriter, 'csv': CSVWriter, 'json': JSONWriter}
+
+
+class FormCache:
+    """Keeps rendered workbooks of forms on disk, keyed on content of the form.
+
+    Key of a form is a hash of its headers and rows, version of the converter,
+    options of conversion and limits of ExpressionBudget, so a changed form or
+    option never hits stale workbook. Least recently used workbooks are evicted above maxSize bytes.
+    """
+    defaultMaxSize = 512 * 2 ** 20
+
+    def __init__(self, directory=None, maxSize=None, options=()):
+        self.directory = directory or self.defaultDirectory()
+        self.maxSize = maxSize if maxSize is not None else self.defaultMaxSize
+        self.options = options
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def defaultDirectory():
+        """Returns directory of the cache in user's cache directory."""
+        cacheHome = os.environ.get('XDG_CACHE_HOME',
+                                   os.path.join(os.path.expanduser('~'), '.cache'))
+        return os.path.join(cacheHome, 'rosetta-form-scripts')
+
+    def makeKey(self, form):
+        """Returns key of the form converted with options of this cache."""
+        import hashlib
+
+        if not isinstance(form.questions, list):
+            form.questions = list(form.questions)
+        digest = hashlib.sha256(converterVersion().encode('utf-8'))
+        budget = [ExpressionBudget.maxLength, ExpressionBudget.maxSeconds]
+        digest.update(json.dumps([list(self.options), budget, form.name, form.headers,
+                                  form.questions]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns workbook stored under key or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores workbook under key.
+
+        Errors of the cache directory are ignored, the workbook is only
+        not stored then and converted again next time.
+        """
+        import tempfile
+
+        path = self._path(key)
+        tempPath = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            descriptor, tempPath = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(tempPath, path)
+        except OSError:
+            if tempPath is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tempPath)
+
+    def evict(self):
+        """Removes least recently used workbooks until cache fits in maxSize."""
+        entries = []
+        for directory, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entrySize, path in sorted(entries):
+            if size <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entrySize
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+
+@functools.lru_cache(maxsize=None)
+def converterVersion():
+    """Returns version of the converter code and of the libraries writing workbooks."""
+    import hashlib
+    import importlib.metadata
 
-def readRedcapFile(filename):
-    """Reads content of the redcap file and returns it."""
-    content = RedcapContent()
+    with open(__file__, 'rb') as file:
+        version = hashlib.sha256(file.read()).hexdigest()
+    for package in ('xlwt', 'xlsxwriter', 'html2text'):
+        try:
+            version += ' {}={}'.format(package, importlib.metadata.version(package))
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return version
+
+
+def readRedcapFile(filename, stream=False):
+    """Reads content of the redcap file and returns it.
+
+    In stream mode only headers are read at once, questions are read
+    from the file while they are iterated over.
+    """
+    if stream:
+        file = open(filename, newline='', encoding='utf-8-sig')
+        content = readRedcapStream(file, stream)
+        content.questions = _readRows(content.questions, file)
+        return content
 
     with open(filename, newline='', encoding='utf-8-sig') as file:
-        reader = csv.reader(file)
+        return readRedcapStream(file)
 
-        for i, row in enumerate(reader):
-            if i == 0:
-                content.headers = row
-            else:
-                content.questions.append(row)
 
-    return content
+def readRedcapStream(file, stream=False):
+    """Reads content of redcap file from a text stream and returns it.
+
+    In stream mode questions are read while they are iterated over.
+    """
+    import csv
+
+    reader = csv.reader(file)
+    headers = next(reader, [])
+    if headers:
+        headers[0] = headers[0].lstrip('\ufeff')
+
+    if stream:
+        return RedcapContent('', headers, _readRows(reader))
+    return RedcapContent('', headers, list(reader))
+
+
+def _readRows(reader, file=None):
+    try:
+        for row in reader:
+            yield row
+    finally:
+        if file is not None:
+            file.close()
+
+
+class Profiler:
+    """Records wall time, calls, rows and peak memory of conversion stages.
+
+    Stages are instrumented by wrapping their functions when the profiler
+    is enabled, so conversion runs without any overhead otherwise.
+    """
+    converterClasses = [NameConverter, TypeConverter, LabelConverter,
+                        ConstraintConverter, RequiredConverter, ChoicesConverter,
+                        DeafultsConverter, ReadOnlyConverter, HintsConverter,
+                        HeaderConverter]
+    translatorClasses = [RelevantConverter, CalculationsConverter]
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self._originals = []
+        self._memoryStack = []
+
+    def enable(self):
+        """Instruments conversion stages and starts tracing memory."""
+        module = sys.modules[__name__]
+        self.instrument(module, 'readRedcapFile', 'readRedcapFile',
+                        lambda args, result: self._countRows(result.questions))
+        self.instrument(Converter, '_separateForms', 'Converter._separateForms',
+                        lambda args, result: self._countRows(args[1].questions))
+        for converterClass in converterFromEngine.values():
+            self.instrument(converterClass, '_convertContent',
+                            converterClass.__name__ + '._convertContent',
+                            lambda args, result: self._countRows(args[1]))
+        for converterClass in self.converterClasses:
+            self.instrument(converterClass, 'convertToXLS',
+                            converterClass.__name__ + '.convertToXLS')
+        for translatorClass in self.translatorClasses:
+            self.instrument(translatorClass, 'translate', translatorClass.__name__ + '.translate')
+        self.instrument(ChoicesConverter, 'parseToXLS', 'ChoicesConverter.parseToXLS')
+        for writerClass in writerFromFormat.values():
+            self.instrument(writerClass, '_writeFile', 'XLSWriter._writeFile',
+                            lambda args, result: len(args[2].questions) + len(args[2].choices))
+        tracemalloc.start()
+
+    def disable(self):
+        """Restores original functions and stops tracing memory."""
+        for owner, attribute, original in reversed(self._originals):
+            setattr(owner, attribute, original)
+        self._originals = []
+        tracemalloc.stop()
+
+    def instrument(self, owner, attribute, name, countRows=None):
+        """Replaces function attribute of owner with one recording stage name."""
+        original = vars(owner)[attribute]
+        self._originals.append((owner, attribute, original))
+        if isinstance(original, staticmethod):
+            setattr(owner, attribute, staticmethod(self._wrap(original.__func__, name, countRows)))
+        else:
+            setattr(owner, attribute, self._wrap(original, name, countRows))
+
+    def _wrap(self, function, name, countRows):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0,
+                                              'rows': 0, 'peakMemory': 0})
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self._enterStage()
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                stage['seconds'] += time.perf_counter() - start
+                stage['calls'] += 1
+                stage['peakMemory'] = max(stage['peakMemory'], self._exitStage())
+            stage['rows'] += countRows(args, result) if countRows else 1
+            return result
+
+        return wrapper
+
+    def _enterStage(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memoryStack:
+            self._memoryStack[-1][1] = max(self._memoryStack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._memoryStack.append([current, 0])
+
+    def _exitStage(self):
+        start, childrenPeak = self._memoryStack.pop()
+        peak = max(tracemalloc.get_traced_memory()[1], childrenPeak)
+        if self._memoryStack:
+            self._memoryStack[-1][1] = max(self._memoryStack[-1][1], peak)
+        return peak - start
+
+    def _countRows(self, rows):
+        return len(rows) if isinstance(rows, list) else 0
+
+    def report(self):
+        """Returns recorded statistics of stages."""
+        report = collections.OrderedDict()
+        for name, stage in self.stages.items():
+            if stage['calls']:
+                report[name] = dict(stage)
+                seconds = stage['seconds']
+                report[name]['rowsPerSecond'] = stage['rows'] / seconds if seconds else None
+        return report
+
+    def formatTable(self):
+        """Returns recorded statistics of stages as a human-readable table."""
+        lines = ['{:<36} {:>8} {:>8} {:>10} {:>12} {:>10}'.format(
+            'stage', 'calls', 'rows', 'seconds', 'rows/s', 'peak MiB')]
+        for name, stage in self.report().items():
+            rowsPerSecond = stage['rowsPerSecond'] or 0
+            lines.append('{:<36} {:>8} {:>8} {:>10.4f} {:>12.1f} {:>10.2f}'.format(
+                name, stage['calls'], stage['rows'], stage['seconds'],
+                rowsPerSecond, stage['peakMemory'] / 2 ** 20))
+        return '\n'.join(lines)
+
+
+class Pipeline:
+    """Runs reading, conversion and writing of forms as concurrent stages.
+
+    Reading and conversion run in threads connected to the next stage by
+    queues of at most queueSize forms, so a stage waits when the next one
+    falls behind and memory stays bounded. Busy and idle time of stages and
+    depth of queues are recorded to tune queueSize.
+    """
+    stageNames = ['read', 'convert', 'write']
+    pollSeconds = 0.1
+
+    def __init__(self, queueSize=2):
+        self.queueSize = queueSize
+        self.stages = collections.OrderedDict(
+            (name, {'forms': 0, 'busy': 0.0, 'idle': 0.0}) for name in self.stageNames)
+        self.queues = collections.OrderedDict(
+            (name, {'puts': 0, 'maxDepth': 0, 'totalDepth': 0}) for name in self.stageNames[:-1])
+        self._stopped = False
+
+    def run(self, converter, writer):
+        """Converts forms of converter and writes them with writer."""
+        import queue
+        import threading
+
+        self._stopped = False
+        readQueue = queue.Queue(self.queueSize)
+        convertQueue = queue.Queue(self.queueSize)
+        threads = [threading.Thread(target=self._runStage,
+                                    args=('read', iter(converter.forms), readQueue)),
+                   threading.Thread(target=self._runStage,
+                                    args=('convert',
+                                          converter.iterConvert(self._iterQueue(readQueue, 'convert')),
+                                          convertQueue))]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        try:
+            writer.write(self._iterQueue(convertQueue, 'write'))
+        finally:
+            self.stages['write']['busy'] += time.perf_counter() - start
+            self._stopped = True
+            for thread in threads:
+                thread.join()
+
+    def _runStage(self, name, source, output):
+        stage = self.stages[name]
+        end = (False, None)
+        try:
+            for item in self._timeStage(stage, source):
+                waitStart = time.perf_counter()
+                self._put(output, (True, item))
+                stage['idle'] += time.perf_counter() - waitStart
+                stage['forms'] += 1
+                self._recordDepth(name, output)
+        except _PipelineStopped:
+            return
+        except BaseException as e:
+            end = (False, e)
+
+        try:
+            self._put(output, end)
+        except _PipelineStopped:
+            pass
+
+    def _timeStage(self, stage, source):
+        source = iter(source)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(source)
+            except StopIteration:
+                return
+            finally:
+                stage['busy'] += time.perf_counter() - start
+            yield item
+
+    def _iterQueue(self, input_, name):
+        """Yields items of queue, time waiting for them is idle time of stage."""
+        import queue
+
+        stage = self.stages[name]
+        while True:
+            start = time.perf_counter()
+            try:
+                isItem, item = input_.get(timeout=self.pollSeconds)
+            except queue.Empty:
+                if self._stopped:
+                    raise _PipelineStopped()
+                continue
+            finally:
+                waited = time.perf_counter() - start
+                stage['idle'] += waited
+                stage['busy'] -= waited
+            if not isItem:
+                if item is not None:
+                    raise item
+                return
+            if name == 'write':
+                stage['forms'] += 1
+            yield item
+
+    def _put(self, output, item):
+        import queue
+
+        while True:
+            if self._stopped:
+                raise _PipelineStopped()
+            try:
+                output.put(item, timeout=self.pollSeconds)
+                return
+            except queue.Full:
+                continue
+
+    def _recordDepth(self, name, output):
+        depth = output.qsize()
+        queueStats = self.queues[name]
+        queueStats['puts'] += 1
+        queueStats['totalDepth'] += depth
+        queueStats['maxDepth'] = max(queueStats['maxDepth'], depth)
+
+    def report(self):
+        """Returns busy and idle time of stages and depth of queues after them."""
+        report = {'queueSize': self.queueSize, 'stages': collections.OrderedDict()}
+        for name, stage in self.stages.items():
+            report['stages'][name] = dict(stage)
+            queueStats = self.queues.get(name)
+            if queueStats is not None:
+                puts = queueStats['puts']
+                report['stages'][name]['maxQueueDepth'] = queueStats['maxDepth']
+                report['stages'][name]['meanQueueDepth'] = queueStats['totalDepth'] / puts if puts else 0.0
+        return report
+
+    def formatTable(self):
+        """Returns recorded statistics of stages as a human-readable table."""
+        lines = ['{:<10} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'forms', 'busy s', 'idle s', 'max queue', 'mean queue')]
+        for name, stage in self.report()['stages'].items():
+            lines.append('{:<10} {:>8} {:>10.4f} {:>10.4f} {:>10} {:>10}'.format(
+                name, stage['forms'], stage['busy'], stage['idle'],
+                stage.get('maxQueueDepth', '-'),
+                '{:.2f}'.format(stage['meanQueueDepth']) if 'meanQueueDepth' in stage else '-'))
+        return '\n'.join(lines)
+
+
+class _PipelineStopped(Exception):
+    pass
+
+
+def convertFile(filename, savefile, mode, columnsToCopy, stream=False, formJobs=1,
+                compressLevel=None, outputFormat='xls', cacheDir=None, cacheSize=None,
+                useCache=False, mergeForms=False, engine='rows', pipeline=None):
+    """Converts redcap file to XLSForm file and returns used converter.
+
+    In zip_xls mode workbooks of forms are rendered by formJobs processes
+    and compressed with compressLevel, or stored uncompressed if it is None.
+    Workbooks are written in .xls or .xlsx format depending on outputFormat.
+    With useCache, workbooks of unchanged forms are taken from FormCache
+    in cacheDir instead of being converted again. With mergeForms, forms
+    referring to each other are merged into one form in zip_xls mode.
+    Engine selects converter from converterFromEngine. If Pipeline is
+    given, the file is read, converted and written by its concurrent stages.
+    """
+    cache = None
+    if useCache:
+        cache = FormCache(cacheDir, cacheSize, (mode, columnsToCopy, outputFormat))
+
+    stream = stream or pipeline is not None
+    fileContent = readRedcapFile(filename, stream)
+    converter = converterFromEngine[engine](fileContent, mode, columnsToCopy, stream, cache,
+                                            mergeForms)
+    writer = writerFromFormat[outputFormat]
+    if pipeline is not None:
+        pipeline.run(converter, writer(savefile, mode, formJobs, compressLevel, cache))
+        return converter
+
+    if stream:
+        convertedContent = converter.iterConvert()
+    else:
+        convertedContent = converter.convert()
+    writer(savefile, mode, formJobs, compressLevel, cache).write(convertedContent)
+    return converter
+
+
+def convert(source, mode='zip_xls', columnsToCopy=None, output=None,
+            outputFormat='xls', compressLevel=None, mergeForms=False, engine='rows'):
+    """Converts redcap content in memory and returns converted file as bytes.
+
+    Source is bytes or a text or binary file object with the content of
+    redcap file. If output file object is given, converted file is written
+    to it instead and None is returned. Nothing is written to disk and no
+    state is shared between calls, so it is safe to use from many threads.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        fileContent = readRedcapStream(io.StringIO(bytes(source).decode('utf-8-sig'),
+                                                   newline=''))
+    elif isinstance(source.read(0), bytes):
+        text = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+        try:
+            fileContent = readRedcapStream(text)
+        finally:
+            text.detach()
+    else:
+        fileContent = readRedcapStream(source)
+
+    converter = converterFromEngine[engine](fileContent, mode, columnsToCopy or [],
+                                            mergeForms=mergeForms)
+    buffer = output if output is not None else io.BytesIO()
+    writer = writerFromFormat[outputFormat]
+    writer(buffer, mode, compressLevel=compressLevel, inMemory=True).write(converter.convert())
+
+    if output is None:
+        return buffer.getvalue()
+
+
+def batchConvert(source, outputDir, mode, columnsToCopy, jobs=None, **options):
+    """Converts all redcap files matching source in a pool of processes.
+
+    Source is a directory with CSV files or a glob pattern, options are
+    passed to convertFile. Returns summary of the conversion, a failure
+    of one file does not stop the others.
+    """
+    if os.path.isdir(source):
+        filenames = sorted(glob.glob(os.path.join(source, '*.csv')))
+    else:
+        filenames = sorted(glob.glob(source))
+    os.makedirs(outputDir, exist_ok=True)
+
+    outputFormat = options.get('outputFormat', 'xls')
+    tasks = [(os.path.abspath(filename),
+              os.path.abspath(makeSavefileName(filename, mode, outputDir, outputFormat)),
+              mode, columnsToCopy, options)
+             for filename in filenames]
+    start = time.perf_counter()
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_convertBatchFile, tasks))
+
+    failed = [result for result in results if result['status'] != 'ok']
+    return {'seconds': time.perf_counter() - start,
+            'succeeded': len(results) - len(failed),
+            'failed': len(failed),
+            'files': results}
+
+
+def _convertBatchFile(task):
+    filename, savefile, mode, columnsToCopy, options = task
+    result = {'filename': filename, 'savefile': savefile}
+    start = time.perf_counter()
+    try:
+        convertFile(filename, savefile, mode, columnsToCopy, **options)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = type(e).__name__
+        result['message'] = str(e.args[0]) if e.args else ''
+        result['exitCode'] = exitCodeFromException(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def exitCodeFromException(exception):
+    """Returns exit code of the script for exception raised by conversion."""
+    if isinstance(exception, CrossFormsReferenceException):
+        return 1
+    return 2
+
+
+def makeSavefileName(filename, mode, outputDir=None, outputFormat='xls'):
+    """Returns name of converted file based on the name of redcap file."""
+    ext_from_mode = {'zip_xls': '.zip', 'single_xls': writerFromFormat[outputFormat].extension}
+    savefile = os.path.splitext(filename)[0]
+    if outputDir is not None:
+        savefile = os.path.join(outputDir, os.path.basename(savefile))
+    return savefile + ext_from_mode[mode]
 
 
 def parseArgs():
-    """Returns name of file to convert and name of file to write result to."""
-    ext_from_mode = {'zip_xls': '.zip', 'single_xls': '.xls'}
+    """Returns parsed arguments with defaults filled in."""
     argParser = argparse.ArgumentParser()
-    argParser.add_argument("filename")
+    argParser.add_argument("filename",
+                           help="REDCap file to convert, or directory or glob " +
+                                "pattern of files in batch mode")
     argParser.add_argument("-s", "--savefile",
                            help="Name of converted file. If not specified, " +
                                 "then name is the same as input file")
@@ -805,38 +1977,189 @@ def parseArgs():
                            help="Mode of conversion:\n" +
                            "zip_xls - creates new file for each form name in file (default)\n" +
                            "single_xls - creates single file with all forms in it")
+    argParser.add_argument("-f", "--format",
+                           choices=sorted(writerFromFormat),
+                           default='xls',
+                           help="Format of written forms: .xls or .xlsx workbooks, " +
+                                "survey.csv and choices.csv zipped per form or " +
+                                "JSON document (default: xls)")
     argParser.add_argument("-c", "--copycolumn",
                            nargs='*',
                            help="Select additional columns to copy to converted file")
+    argParser.add_argument("-v", "--verbose",
+                           action='store_true',
+                           help="Print statistics of the conversion")
+    argParser.add_argument("--stream",
+                           action='store_true',
+                           help="Read, convert and write forms one at a time " +
+                                "to keep memory usage bounded by the largest form")
+    argParser.add_argument("--engine",
+                           default='rows',
+                           choices=sorted(converterFromEngine),
+                           help="Convert forms row by row or column by column " +
+                                "with pandas, which gives the same result and is " +
+                                "not faster (default: rows)")
+    argParser.add_argument("--mergeforms",
+                           action='store_true',
+                           help="In zip_xls mode merge forms referring to each other " +
+                                "into one form instead of failing")
+    argParser.add_argument("--pipeline",
+                           action='store_true',
+                           help="Read, convert and write forms in concurrent stages " +
+                                "connected by bounded queues")
+    argParser.add_argument("--queuesize",
+                           type=int,
+                           default=2,
+                           help="Pipeline mode: number of forms waiting between stages " +
+                                "(default: 2)")
+    argParser.add_argument("--formjobs",
+                           type=int,
+                           default=1,
+                           help="Number of processes rendering workbooks of forms " +
+                                "in zip_xls mode (default: 1)")
+    argParser.add_argument("--compresslevel",
+                           type=int,
+                           choices=range(10),
+                           help="Compress zip archive with given level from 0 to 9 " +
+                                "(default: no compression)")
+    argParser.add_argument("--labelcache",
+                           type=int,
+                           default=LabelConverter.defaultCacheSize,
+                           help="Number of converted HTML labels to keep in cache " +
+                                "(default: {})".format(LabelConverter.defaultCacheSize))
+    argParser.add_argument("--maxexpressionlength",
+                           type=int,
+                           default=ExpressionBudget.maxLength,
+                           help="Fail on branching logic or calculation longer than this " +
+                                "number of characters (default: {})".format(ExpressionBudget.maxLength))
+    argParser.add_argument("--maxexpressiontime",
+                           type=float,
+                           default=ExpressionBudget.maxSeconds,
+                           help="Fail on branching logic or calculation converted longer " +
+                                "than this number of seconds (default: {})".format(ExpressionBudget.maxSeconds))
+    argParser.add_argument("--profile",
+                           nargs='?',
+                           const='table',
+                           choices=['table', 'json'],
+                           help="Print time, calls, rows per second and peak memory " +
+                                "of conversion stages as a table (default) or JSON")
+    argParser.add_argument("--no-cache",
+                           dest='cache',
+                           action='store_false',
+                           help="Convert all forms instead of reusing workbooks " +
+                                "of unchanged forms from cache")
+    argParser.add_argument("--cachedir",
+                           help="Directory of cache of converted forms " +
+                                "(default: {})".format(FormCache.defaultDirectory()))
+    argParser.add_argument("--cachesize",
+                           type=int,
+                           default=FormCache.defaultMaxSize // 2 ** 20,
+                           help="Maximal size of cache in MiB " +
+                                "(default: {})".format(FormCache.defaultMaxSize // 2 ** 20))
+    argParser.add_argument("-o", "--outputdir",
+                           help="Batch mode: convert all files matching filename " +
+                                "and save them in this directory")
+    argParser.add_argument("-j", "--jobs",
+                           type=int,
+                           help="Number of processes converting files in batch mode " +
+                                "(default: number of CPUs)")
+    argParser.add_argument("--summary",
+                           help="Batch mode: JSON file to write summary to " +
+                                "(default: summary.json in output directory)")
     args = argParser.parse_args()
 
-    filename = args.filename
+    if not args.mode:
+        args.mode = 'zip_xls'
 
-    mode = 'zip_xls'
-    if args.mode:
-        mode = args.mode
+    if not args.savefile:
+        args.savefile = makeSavefileName(args.filename, args.mode, outputFormat=args.format)
 
-    if args.savefile:
-        savefile = args.savefile
-    else:
-        savefile = os.path.splitext(filename)[0]
-        savefile += ext_from_mode[mode]
+    if not args.copycolumn:
+        args.copycolumn = []
+
+    if args.outputdir and not args.summary:
+        args.summary = os.path.join(args.outputdir, 'summary.json')
 
-    columnsToCopy = []
-    if args.copycolumn:
-        columnsToCopy = args.copycolumn
+    return args
 
-    return filename, savefile, mode, columnsToCopy
+
+def printStatistics(converter):
+    """Prints statistics of finished conversion."""
+    print('Choices lists: {} created, {} reused'.format(converter.createdLists,
+                                                        converter.reusedLists))
+    labelsCache = LabelConverter.cacheInfo()
+    print('Labels cache: {} hits, {} misses'.format(labelsCache.hits,
+                                                    labelsCache.misses))
+    choicesCache = ChoicesConverter.parse.cache_info()
+    print('Choices cache: {} hits, {} misses'.format(choicesCache.hits,
+                                                     choicesCache.misses))
+    if converter.cache is not None:
+        print('Forms cache: {} hits, {} misses'.format(converter.cache.hits,
+                                                       converter.cache.misses))
+
+
+def printProfile(profiler, profileFormat):
+    """Prints statistics of profiled stages in given format."""
+    if profileFormat == 'json':
+        print(json.dumps(profiler.report(), indent=2))
+    else:
+        print(profiler.formatTable())
+
+
+def runBatch(args):
+    """Runs batch conversion, writes its summary and returns exit code."""
+    summary = batchConvert(args.filename, args.outputdir, args.mode,
+                           args.copycolumn, args.jobs, stream=args.stream,
+                           compressLevel=args.compresslevel, outputFormat=args.format,
+                           useCache=args.cache, cacheDir=args.cachedir,
+                           cacheSize=args.cachesize * 2 ** 20, mergeForms=args.mergeforms,
+                           engine=args.engine,
+                           pipeline=Pipeline(args.queuesize) if args.pipeline else None)
+    if args.cache:
+        FormCache(args.cachedir, args.cachesize * 2 ** 20).evict()
+    with open(args.summary, 'w') as file:
+        json.dump(summary, file, indent=2)
+
+    for result in summary['files']:
+        if result['status'] != 'ok':
+            print('{}: {}'.format(result['filename'], result['message']))
+    print('Converted {} of {} files in {:.2f}s'.format(summary['succeeded'],
+                                                     len(summary['files']),
+                                                     summary['seconds']))
+    return 1 if summary['failed'] else 0
 
 
 if __name__ == "__main__":
-    filename, savefile, mode, columnsToCopy = parseArgs()
+    args = parseArgs()
+    LabelConverter.configureCache(args.labelcache)
+    ExpressionBudget.configure(args.maxexpressionlength, args.maxexpressiontime)
+
+    if args.outputdir:
+        exit(runBatch(args))
+
+    pipeline = None
+    if args.pipeline:
+        pipeline = Pipeline(args.queuesize)
 
-    fileContent = readRedcapFile(filename)
+    profiler = None
+    if args.profile:
+        profiler = Profiler()
+        profiler.enable()
 
     try:
-        convertedContent = Converter(fileContent, mode, columnsToCopy).convert()
-        XLSWriter(savefile, mode).write(convertedContent)
+        converter = convertFile(args.filename, args.savefile, args.mode,
+                                args.copycolumn, args.stream, args.formjobs,
+                                args.compresslevel, args.format, args.cachedir,
+                                args.cachesize * 2 ** 20, args.cache, args.mergeforms,
+                                args.engine, pipeline)
+        if args.cache:
+            converter.cache.evict()
+        if args.verbose:
+            printStatistics(converter)
+            if pipeline:
+                print(pipeline.formatTable())
+        if profiler:
+            printProfile(profiler, args.profile)
     except CrossFormsReferenceException as e:
         msg = e.args[0]
         print(msg)
@@ -846,6 +2169,5 @@ if __name__ == "__main__":
         print(msg)
         exit(2)
     except Exception as e:
-        msg = e.args[0]
-        print(msg)
+        print(e)
         exit(2)
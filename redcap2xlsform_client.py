@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""This module sends redcap files to redcap2xlsform_server for conversion.
+
+It accepts the same arguments as redcap2xlsform.py, except for those of
+batch mode, but does not import any of the conversion dependencies, so it
+starts quickly. Arguments which apply only to local conversion are
+accepted and ignored.
+"""
+import argparse
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+defaultServer = 'http://127.0.0.1:8765'
+extensionFromFormat = {'xls': '.xls', 'xlsx': '.xlsx', 'csv': '.zip', 'json': '.json'}
+
+
+def convertRemotely(server, filename, savefile, mode, outputFormat, columnsToCopy, compressLevel,
+                    mergeForms=False, engine='rows'):
+    """Sends redcap file to conversion server and saves converted file."""
+    params = [('mode', mode), ('format', outputFormat)]
+    params += [('copycolumn', column) for column in columnsToCopy]
+    if compressLevel is not None:
+        params.append(('compresslevel', str(compressLevel)))
+    if mergeForms:
+        params.append(('mergeforms', '1'))
+    if engine != 'rows':
+        params.append(('engine', engine))
+    url = server.rstrip('/') + '/convert?' + urllib.parse.urlencode(params)
+
+    with open(filename, 'rb') as file:
+        source = file.read()
+
+    request = urllib.request.Request(url, data=source, method='POST',
+                                     headers={'Content-Type': 'text/csv'})
+    with urllib.request.urlopen(request) as response:
+        converted = response.read()
+
+    with open(savefile, 'wb') as file:
+        file.write(converted)
+
+
+def parseArgs():
+    """Returns parsed arguments with defaults filled in."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("filename")
+    argParser.add_argument("-s", "--savefile",
+                           help="Name of converted file. If not specified, " +
+                                "then name is the same as input file")
+    argParser.add_argument("-m", "--mode",
+                           default='zip_xls',
+                           choices=['zip_xls', 'single_xls'],
+                           help="Mode of conversion (default: zip_xls)")
+    argParser.add_argument("-f", "--format",
+                           default='xls',
+                           choices=sorted(extensionFromFormat),
+                           help="Format of written forms (default: xls)")
+    argParser.add_argument("-c", "--copycolumn",
+                           nargs='*',
+                           default=[],
+                           help="Select additional columns to copy to converted file")
+    argParser.add_argument("--compresslevel",
+                           type=int,
+                           choices=range(10),
+                           help="Compress zip archive with given level from 0 to 9")
+    argParser.add_argument("--engine",
+                           default='rows',
+                           choices=['columnar', 'rows'],
+                           help="Convert forms row by row or column by column " +
+                                "with pandas, which gives the same result and is " +
+                                "not faster (default: rows)")
+    argParser.add_argument("--mergeforms",
+                           action='store_true',
+                           help="In zip_xls mode merge forms referring to each other " +
+                                "into one form instead of failing")
+    argParser.add_argument("--server",
+                           default=os.environ.get('REDCAP2XLSFORM_SERVER', defaultServer),
+                           help="URL of conversion server (default: $REDCAP2XLSFORM_SERVER " +
+                                "or {})".format(defaultServer))
+    addLocalArgs(argParser)
+    args = argParser.parse_args()
+
+    if not args.savefile:
+        ext_from_mode = {'zip_xls': '.zip', 'single_xls': extensionFromFormat[args.format]}
+        args.savefile = os.path.splitext(args.filename)[0] + ext_from_mode[args.mode]
+
+    return args
+
+
+def addLocalArgs(argParser):
+    """Adds arguments of redcap2xlsform.py which do not apply to conversion on server."""
+    switches = [["-v", "--verbose"], ["--stream"], ["--pipeline"], ["--no-cache"]]
+    options = [(["--formjobs"], int), (["--queuesize"], int), (["--labelcache"], int),
+               (["--maxexpressionlength"], int), (["--maxexpressiontime"], float),
+               (["--cachedir"], str), (["--cachesize"], int)]
+    names = [flags[-1] for flags in switches] + [flags[-1] for flags, _ in options]
+    localArgs = argParser.add_argument_group(
+        "local conversion arguments",
+        "Accepted for compatibility with redcap2xlsform.py and ignored: " +
+        ", ".join(names + ["--profile"]))
+    for flags in switches:
+        localArgs.add_argument(*flags, action='store_true', help=argparse.SUPPRESS)
+    for flags, valueType in options:
+        localArgs.add_argument(*flags, type=valueType, help=argparse.SUPPRESS)
+    localArgs.add_argument("--profile", nargs='?', const='table', choices=['table', 'json'],
+                           help=argparse.SUPPRESS)
+
+
+def printHTTPError(error):
+    """Prints message of error response of the server and returns exit code."""
+    try:
+        response = json.loads(error.read().decode('utf-8'))
+        print(response['message'])
+        return response['exitCode']
+    except (ValueError, KeyError, TypeError):
+        print('Server responded with {} {}'.format(error.code, error.reason))
+        return 2
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+
+    try:
+        convertRemotely(args.server, args.filename, args.savefile, args.mode,
+                        args.format, args.copycolumn, args.compresslevel,
+                        args.mergeforms, args.engine)
+    except urllib.error.HTTPError as e:
+        exit(printHTTPError(e))
+    except (urllib.error.URLError, OSError) as e:
+        print(e)
+        exit(2)
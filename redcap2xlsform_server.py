@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""This module runs redcap2xlsform as a local HTTP server, so that modules
+are imported and label and expression caches stay warm between conversions.
+
+Conversion jobs are sent as POST requests to /convert with the content of
+the redcap file as body and options as query parameters: mode, format,
+copycolumn (repeated for every column), compresslevel, mergeforms and engine.
+"""
+import argparse
+import concurrent.futures
+import http.server
+import json
+import urllib.parse
+
+import redcap2xlsform
+
+
+class ConversionServer(http.server.ThreadingHTTPServer):
+    """Accepts conversion jobs and runs them in a bounded pool of processes."""
+    daemon_threads = True
+
+    def __init__(self, address, jobs, labelCacheSize):
+        http.server.ThreadingHTTPServer.__init__(self, address, ConversionRequestHandler)
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                               initializer=_initWorker,
+                                                               initargs=(labelCacheSize,))
+
+    def server_close(self):
+        http.server.ThreadingHTTPServer.server_close(self)
+        self.executor.shutdown()
+
+
+class ConversionRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handles single conversion request."""
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/convert':
+            self._sendError(404, 'NotFound', 'Unknown path: ' + url.path, 2)
+            return
+
+        try:
+            options = self._parseOptions(url.query)
+        except ValueError as e:
+            self._sendError(400, 'BadRequest', str(e), 2)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        source = self.rfile.read(length)
+        future = self.server.executor.submit(redcap2xlsform.convert, source, **options)
+
+        try:
+            converted = future.result()
+        except Exception as e:
+            message = str(e.args[0]) if e.args else ''
+            self._sendError(422, type(e).__name__, message,
+                            redcap2xlsform.exitCodeFromException(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(converted)))
+        self.end_headers()
+        self.wfile.write(converted)
+
+    def _parseOptions(self, query):
+        params = urllib.parse.parse_qs(query)
+        options = {'mode': params.get('mode', ['zip_xls'])[0],
+                   'outputFormat': params.get('format', ['xls'])[0],
+                   'columnsToCopy': params.get('copycolumn', [])}
+        if options['mode'] not in ('zip_xls', 'single_xls'):
+            raise ValueError('Unknown mode: ' + options['mode'])
+        if options['outputFormat'] not in redcap2xlsform.writerFromFormat:
+            raise ValueError('Unknown format: ' + options['outputFormat'])
+        if 'compresslevel' in params:
+            options['compressLevel'] = int(params['compresslevel'][0])
+        if 'mergeforms' in params:
+            options['mergeForms'] = params['mergeforms'][0] == '1'
+        if 'engine' in params:
+            options['engine'] = params['engine'][0]
+            if options['engine'] not in redcap2xlsform.converterFromEngine:
+                raise ValueError('Unknown engine: ' + options['engine'])
+        return options
+
+    def _sendError(self, status, error, message, exitCode):
+        body = json.dumps({'error': error,
+                           'message': message,
+                           'exitCode': exitCode}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _initWorker(labelCacheSize):
+    redcap2xlsform.LabelConverter.configureCache(labelCacheSize)
+
+
+def parseArgs():
+    """Returns parsed arguments of the server."""
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--host", default='127.0.0.1',
+                           help="Address to listen on (default: 127.0.0.1)")
+    argParser.add_argument("-p", "--port", type=int, default=8765,
+                           help="Port to listen on (default: 8765)")
+    argParser.add_argument("-j", "--jobs", type=int,
+                           help="Number of processes running conversions " +
+                                "(default: number of CPUs)")
+    argParser.add_argument("--labelcache", type=int,
+                           default=redcap2xlsform.LabelConverter.defaultCacheSize,
+                           help="Number of converted HTML labels to keep in cache " +
+                                "of every process")
+    return argParser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parseArgs()
+    server = ConversionServer((args.host, args.port), args.jobs, args.labelcache)
+    print('Listening on http://{}:{}/convert'.format(args.host, args.port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -8,11 +8,14 @@ setup(name='rosetta_form_scripts',
     author='QED Inc.',
     author_email='info@qed.ai',
     packages=[],
-    scripts=['redcap2xlsform.py', 'split_xls_sheets.py'],
+    scripts=['redcap2xlsform.py', 'redcap2xlsform_server.py',
+             'redcap2xlsform_client.py', 'split_xls_sheets.py'],
     install_requires=[
-        'xlwt',
+        'xlwt==1.3.0',
+        'xlsxwriter',
         'html2text',
         'xlrd',
+        'openpyxl',
         'pandas'
     ],
 )
@@ -1,29 +1,267 @@
 #!/usr/bin/env python
+import argparse
+import datetime
+import glob
 import os
-import sys
+import time
 
-import pandas
+def run_conversion(xls_file, dir_path, sheets=None):
+    import pandas
 
-def run_conversion(xls_file, dir_path):
-    sheets = pandas.read_excel(xls_file, sheetname=None)
+    sheets = pandas.read_excel(xls_file, sheet_name=sheets)
     for sheetname, dataframe in sheets.items():
         destination_path = os.path.join(dir_path, sheetname + '.csv')
         print('Exporting sheet \"{}\" to {}'.format(sheetname, destination_path))
         dataframe.to_csv(destination_path)
 
-def print_usage():
-    print("Usage: {} <input_xls_path> <output_path>".format(sys.argv[0]))
+def stream_conversion(xls_path, dir_path, sheets=None):
+    """Exports sheets one at a time, writing rows to CSV as they are read.
+
+    Only the exported sheet is loaded, and it is released before the next
+    one, so unselected sheets are never parsed.
+    """
+    with open_workbook(xls_path) as workbook:
+        for sheetname in select_sheets(workbook, sheets):
+            destination_path = os.path.join(dir_path, sheetname + '.csv')
+            print('Exporting sheet \"{}\" to {}'.format(sheetname, destination_path))
+            export_sheet(workbook, sheetname, destination_path)
+
+def open_workbook(xls_path):
+    with open(xls_path, 'rb') as xls_file:
+        is_xls = xls_file.read(4) == b'\xd0\xcf\x11\xe0'
+    workbook_class = XlsWorkbook if is_xls else XlsxWorkbook
+    return workbook_class(xls_path)
+
+def select_sheets(workbook, sheets):
+    sheet_names = workbook.sheet_names()
+    if sheets is None:
+        return sheet_names
+    missing = [sheetname for sheetname in sheets if sheetname not in sheet_names]
+    if missing:
+        raise ValueError('Sheets not found in workbook: ' + ', '.join(missing))
+    return sheets
+
+def export_sheet(workbook, sheetname, destination_path):
+    """Writes rows of the sheet to CSV, replacing destination only when it is complete."""
+    import csv
+
+    partial_path = destination_path + '.partial'
+    with open(partial_path, 'w', newline='', encoding='utf-8') as csv_file:
+        csv.writer(csv_file).writerows(workbook.iter_rows(sheetname))
+    os.replace(partial_path, destination_path)
+
+def batch_conversion(xls_paths, dir_path, sheets=None, jobs=None, force=False):
+    """Exports sheets of many workbooks in a pool of processes and returns summary.
+
+    Sheets of every workbook are written to a subdirectory named after the
+    workbook. Unless force is set, sheets whose CSV is newer than the
+    workbook are skipped, so an interrupted batch can be resumed.
+    """
+    import concurrent.futures
+
+    start = time.perf_counter()
+    summary = {'exported': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+    tasks = []
+    for xls_path, workbook_name in name_workbooks(xls_paths):
+        workbook_dir = os.path.join(dir_path, workbook_name)
+        try:
+            with open_workbook(xls_path) as workbook:
+                sheet_names = select_sheets(workbook, sheets)
+        except Exception as e:
+            print('{}: {}'.format(xls_path, e))
+            summary['failed'] += 1
+            continue
+        os.makedirs(workbook_dir, exist_ok=True)
+        for sheetname in sheet_names:
+            destination_path = os.path.join(workbook_dir, sheetname + '.csv')
+            if not force and is_up_to_date(destination_path, xls_path):
+                summary['skipped'] += 1
+                continue
+            tasks.append((xls_path, sheetname, destination_path))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(export_sheet_task, task): task for task in tasks}
+        for future in concurrent.futures.as_completed(futures):
+            xls_path, sheetname, destination_path = futures[future]
+            try:
+                summary['bytes'] += future.result()
+            except Exception as e:
+                print('{}: sheet \"{}\": {}'.format(xls_path, sheetname, e))
+                summary['failed'] += 1
+                continue
+            print('Exported sheet \"{}\" to {}'.format(sheetname, destination_path))
+            summary['exported'] += 1
+
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+def name_workbooks(xls_paths):
+    """Yields workbooks with unique names of their subdirectories."""
+    used_names = set()
+    for xls_path in xls_paths:
+        basename = os.path.basename(xls_path)
+        name = os.path.splitext(basename)[0]
+        if name in used_names:
+            name = basename.replace('.', '_')
+        unique_name, number = name, 1
+        while unique_name in used_names:
+            number += 1
+            unique_name = '{}_{}'.format(name, number)
+        used_names.add(unique_name)
+        yield xls_path, unique_name
+
+def export_sheet_task(task):
+    xls_path, sheetname, destination_path = task
+    with open_workbook(xls_path) as workbook:
+        export_sheet(workbook, sheetname, destination_path)
+    return os.path.getsize(destination_path)
+
+def is_up_to_date(destination_path, xls_path):
+    try:
+        return os.path.getmtime(destination_path) >= os.path.getmtime(xls_path)
+    except OSError:
+        return False
+
+def find_workbooks(inputs):
+    """Returns workbooks given as paths, glob patterns or directories."""
+    xls_paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            xls_paths += sorted(glob.glob(os.path.join(path, '*.xls')) +
+                                glob.glob(os.path.join(path, '*.xlsx')))
+        else:
+            xls_paths += sorted(glob.glob(path)) or [path]
+    return list(dict.fromkeys(xls_paths))
+
+def print_summary(summary):
+    seconds = summary['seconds']
+    print('Exported {} sheets, skipped {} up to date, {} failed in {:.2f}s '
+          '({:.1f} sheets/s, {:.2f} MB/s)'.format(summary['exported'], summary['skipped'],
+                                                   summary['failed'], seconds,
+                                                   summary['exported'] / seconds,
+                                                   summary['bytes'] / 1e6 / seconds))
+
+class XlsWorkbook:
+    """Reads .xls workbook with xlrd, loading sheets on demand."""
+    def __init__(self, xls_path):
+        import xlrd
+
+        self.xlrd = xlrd
+        self.book = xlrd.open_workbook(xls_path, on_demand=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.book.release_resources()
+
+    def sheet_names(self):
+        return self.book.sheet_names()
+
+    def iter_rows(self, sheetname):
+        sheet = self.book.sheet_by_name(sheetname)
+        try:
+            for i in range(sheet.nrows):
+                yield [self.cell_value(cell) for cell in sheet.row(i)]
+        finally:
+            self.book.unload_sheet(sheetname)
+
+    def cell_value(self, cell):
+        if cell.ctype == self.xlrd.XL_CELL_DATE:
+            return self.xlrd.xldate_as_datetime(cell.value, self.book.datemode).isoformat(' ')
+        if cell.ctype == self.xlrd.XL_CELL_BOOLEAN:
+            return bool(cell.value)
+        return integral_value(cell.value)
+
+class XlsxWorkbook:
+    """Reads .xlsx workbook with openpyxl in read only mode, row by row."""
+    def __init__(self, xls_path):
+        import openpyxl
+
+        self.book = openpyxl.load_workbook(xls_path, read_only=True, data_only=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.book.close()
+
+    def sheet_names(self):
+        return self.book.sheetnames
+
+    def iter_rows(self, sheetname):
+        for row in self.book[sheetname].iter_rows(values_only=True):
+            yield [self.cell_value(value) for value in row]
+
+    def cell_value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(' ')
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return integral_value(value)
+
+def integral_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description="Exports every sheet of a workbook to a CSV file in output directory")
+    arg_parser.add_argument("input_xls_path",
+                            nargs='+',
+                            help="Workbook to export. In batch mode many workbooks, " +
+                                 "glob patterns or directories with workbooks")
+    arg_parser.add_argument("output_path")
+    arg_parser.add_argument("--stream",
+                            action='store_true',
+                            help="Export one sheet at a time row by row, without pandas. " +
+                                 "Rows are written as they are in the sheet, without index column")
+    arg_parser.add_argument("--sheets",
+                            action='append',
+                            metavar='SHEET',
+                            help="Export only sheet with this name, can be given many times")
+    arg_parser.add_argument("--batch",
+                            action='store_true',
+                            help="Export sheets of all workbooks in a pool of processes, " +
+                                 "each workbook to its own subdirectory of output_path. " +
+                                 "Sheets whose CSV is newer than the workbook are skipped")
+    arg_parser.add_argument("-j", "--jobs",
+                            type=int,
+                            help="Batch mode: number of processes (default: number of CPUs)")
+    arg_parser.add_argument("--force",
+                            action='store_true',
+                            help="Batch mode: export also sheets which are up to date")
+    args = arg_parser.parse_args()
+    if not args.batch and len(args.input_xls_path) > 1:
+        arg_parser.error("many workbooks can be exported only with --batch")
+    return args
 
 def main():
-    if len(sys.argv) != 3:
-        print_usage()
-        exit(1)
-    input_xls_path = sys.argv[1]
-    output_path = sys.argv[2]
+    args = parse_args()
+    if args.batch:
+        os.makedirs(args.output_path, exist_ok=True)
+        summary = batch_conversion(find_workbooks(args.input_xls_path), args.output_path,
+                                   args.sheets, args.jobs, args.force)
+        print_summary(summary)
+        exit(1 if summary['failed'] else 0)
+    input_xls_path = args.input_xls_path[0]
     # TODO handle missing files etc.
+    if args.sheets:
+        try:
+            with open_workbook(input_xls_path) as workbook:
+                select_sheets(workbook, args.sheets)
+        except ValueError as e:
+            print(e)
+            exit(1)
+    os.mkdir(args.output_path)
+    if args.stream:
+        stream_conversion(input_xls_path, args.output_path, args.sheets)
+        return
     input_xls_file = open(input_xls_path, 'rb')
-    os.mkdir(output_path)
-    run_conversion(input_xls_file, output_path)
+    run_conversion(input_xls_file, args.output_path, args.sheets)
 
 if __name__ == '__main__':
     main()